@@ -0,0 +1,98 @@
+# 编译缓存：以 MIDI 文件内容与编译器版本的哈希为键，保存单词流与虚拟机程序
+import hashlib
+import os
+import shutil
+import tempfile
+
+from .core import __version__
+
+__author__ = 'mori'
+
+TOKENS = 'tokens'  # 序列化的单词流，只取决于源代码
+PROGRAM = 'program.mbc'  # 字节码文件，还取决于优化选项
+
+DEFAULT_DIR = 'out/cache'
+DEFAULT_SIZE = 64 * 1024 * 1024  # 默认缓存上限 64MB
+
+
+class CompileCache:
+    """
+    内容寻址的编译缓存，每个键一个目录，目录修改时间作为最近使用时间，超出上限时按 LRU 淘汰
+    """
+
+    def __init__(self, cache_dir=DEFAULT_DIR, max_size=DEFAULT_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key_of(midi_path, options=''):
+        """
+        计算缓存键：编译器版本 + 编译选项 + MIDI 文件内容的 sha256
+        :param options: 影响编译结果的选项
+        """
+        digest = hashlib.sha256(__version__.encode())
+        digest.update(options.encode() + b'\0')
+        with open(midi_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, key, name):
+        """
+        查询缓存
+        :return: 缓存文件路径，未命中返回 None
+        """
+        path = os.path.join(self.cache_dir, key, name)
+        if not os.path.isfile(path):
+            return None
+        os.utime(os.path.join(self.cache_dir, key))  # 更新最近使用时间
+        return path
+
+    def put(self, key, files):
+        """
+        写入缓存
+        :param files: {名称: 文件路径或 bytes}
+        """
+        temp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        for name, data in files.items():
+            if isinstance(data, bytes):
+                with open(os.path.join(temp_dir, name), 'wb') as file:
+                    file.write(data)
+            else:
+                shutil.copyfile(data, os.path.join(temp_dir, name))
+        entry = os.path.join(self.cache_dir, key)
+        self.invalidate(key)
+        os.replace(temp_dir, entry)
+        self.__evict()
+
+    def invalidate(self, key):
+        """
+        删除指定键的缓存
+        """
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def clear(self):
+        """
+        清空全部缓存
+        """
+        for key in os.listdir(self.cache_dir):
+            self.invalidate(key)
+
+    def __evict(self):
+        """
+        总大小超出上限时，按最近使用时间从旧到新淘汰
+        """
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            size = sum(f.stat().st_size for f in os.scandir(entry) if f.is_file())
+            entries.append((os.stat(entry).st_mtime, size, key))
+            total += size
+        entries.sort()
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            self.invalidate(key)
+            total -= size
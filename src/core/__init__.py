@@ -1,2 +1,3 @@
 __author__ = 'mori'
 
+__version__ = '0.10.0'  # 编译器版本，编译产物格式变化时需要修改
@@ -0,0 +1,160 @@
+# 字节码文件（.mbc）：链接后的虚拟机程序的二进制格式，运行时内存映射加载，不需要编译器前端
+import mmap
+import struct
+
+from .ir import Op, Program
+
+__author__ = "mori"
+
+MAGIC = b"MBC\0"
+FORMAT_VERSION = 1  # 文件格式版本，格式变化时需要修改
+FLAG_LINES = 1  # 包含行号表
+
+# 文件头：魔数、格式版本、标志、指令数、常量数、函数数，之后各段依次排列，均为小端序
+HEADER = struct.Struct("<4sHHIII")
+CONSTANT_INT = 0  # 64 位整数常量
+CONSTANT_FLOAT = 1  # 浮点数常量
+CONSTANT_BIG = 2  # 超出 64 位的整数常量，之后为有符号小端序字节
+CONSTANTS = (  # 常量：类型、值，大整数的值为之后的字节数
+    struct.Struct("<Bq"),
+    struct.Struct("<Bd"),
+    struct.Struct("<Bq"),
+)
+FUNCTION = struct.Struct("<IHH")  # 函数：入口指令序号、参数个数、函数名字节数
+INT_MIN, INT_MAX = -(1 << 63), (1 << 63) - 1
+
+
+class BytecodeError(ValueError):
+    """
+    字节码文件格式错误
+    """
+
+
+def dumps(program, lines=True):
+    """
+    程序序列化为字节码
+    :param program: 链接后的程序
+    :param lines: 是否包含行号表
+    :return: 字节码
+    """
+    if not program.linked:
+        raise BytecodeError("只能保存链接后的程序")
+    count = len(program)
+    constants = []  # 常量池，LOADI 的操作数为常量的序号
+    constant_index = {}
+    operands = []
+    for op, arg in zip(program.ops, program.args):
+        if op == Op.LOADI:
+            key = (type(arg), arg)  # 1 与 1.0 是不同的常量
+            index = constant_index.get(key)
+            if index is None:
+                index = constant_index[key] = len(constants)
+                constants.append(arg)
+            arg = index
+        elif arg is None:
+            arg = count  # 没有目标的转移，执行到时越界报错
+        operands.append(arg)
+    parts = [
+        HEADER.pack(
+            MAGIC, FORMAT_VERSION, FLAG_LINES if lines else 0, count, len(constants), len(program.functions)
+        ),
+        bytes(program.ops),
+        bytes(-count % 4),  # 操作数按 4 字节对齐
+        struct.pack("<{}i".format(count), *operands),
+    ]
+    for value in constants:
+        if isinstance(value, float):
+            parts.append(CONSTANTS[CONSTANT_FLOAT].pack(CONSTANT_FLOAT, value))
+        elif INT_MIN <= value <= INT_MAX:
+            parts.append(CONSTANTS[CONSTANT_INT].pack(CONSTANT_INT, value))
+        else:
+            data = value.to_bytes((value.bit_length() + 8) // 8, "little", signed=True)
+            parts.append(CONSTANTS[CONSTANT_BIG].pack(CONSTANT_BIG, len(data)) + data)
+    for name, (entry, par_num) in program.functions.items():
+        name = name.encode("utf-8")
+        parts.append(FUNCTION.pack(entry, par_num, len(name)) + name)
+    if lines:
+        parts.append(bytes(-sum(map(len, parts)) % 4))  # 行号表按 4 字节对齐
+        parts.append(struct.pack("<{}I".format(count), *program.lines))
+    return b"".join(parts)
+
+
+def save(program, file_out, lines=True):
+    """
+    保存字节码文件
+    :param program: 链接后的程序
+    :param file_out: 输出文件名
+    :param lines: 是否包含行号表
+    :return: 输出文件名
+    """
+    with open(file_out, "wb") as file:
+        file.write(dumps(program, lines))
+    return file_out
+
+
+def load(file_in):
+    """
+    内存映射字节码文件并还原程序，操作码与行号直接引用映射的内存
+    :param file_in: 文件名
+    :return: 链接后的程序
+    """
+    with open(file_in, "rb") as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # 空文件
+            raise BytecodeError("不是字节码文件：{}".format(file_in))
+    return loads(data, file_in)
+
+
+def loads(data, name="<bytes>"):
+    """
+    由字节码还原程序
+    :param data: 字节码，bytes 或 mmap
+    :param name: 文件名，用于错误信息
+    :return: 链接后的程序
+    """
+    view = memoryview(data)
+    if view[:len(MAGIC)] != MAGIC:
+        raise BytecodeError("不是字节码文件：{}".format(name))
+    try:
+        magic, version, flags, count, constant_count, function_count = HEADER.unpack_from(view)
+        if version != FORMAT_VERSION:
+            raise BytecodeError("不支持的字节码格式版本 {0}：{1}".format(version, name))
+        offset = HEADER.size
+        ops = view[offset:offset + count]
+        offset += count + (-count % 4)
+        operands = view[offset:offset + 4 * count].cast("i")
+        offset += 4 * count
+        constants = []
+        for _ in range(constant_count):
+            kind = view[offset]
+            constant = CONSTANTS[kind]
+            value = constant.unpack_from(view, offset)[1]
+            offset += constant.size
+            if kind == CONSTANT_BIG:
+                value, offset = int.from_bytes(view[offset:offset + value], "little", signed=True), offset + value
+            constants.append(value)
+        functions = {}
+        for _ in range(function_count):
+            entry, par_num, length = FUNCTION.unpack_from(view, offset)
+            offset += FUNCTION.size
+            functions[str(view[offset:offset + length], "utf-8")] = (entry, par_num)
+            offset += length
+        lines = None
+        if flags & FLAG_LINES:
+            offset += -offset % 4
+            lines = view[offset:offset + 4 * count].cast("I")
+        if len(ops) != count or len(operands) != count or (lines is not None and len(lines) != count):
+            raise BytecodeError("字节码文件不完整：{}".format(name))
+        loadi = Op.LOADI
+        args = [constants[arg] if op == loadi else arg for op, arg in zip(ops, operands)]
+    except (struct.error, TypeError, IndexError, UnicodeDecodeError) as e:
+        raise BytecodeError("字节码文件不完整：{}".format(name)) from e
+    program = Program()
+    program.ops = ops
+    program.args = args
+    if lines is not None:
+        program.lines = lines
+    program.functions = functions
+    program.linked = True
+    return program
@@ -0,0 +1,129 @@
+# 常量折叠：语义分析之前在语法树上计算常量子表达式，并按代数恒等式化简
+from .grammar_tree import Node, NodeKind
+
+__author__ = "mori"
+
+# 运算符 -> 计算函数，与虚拟机的指令一致：除法为真除法，比较与逻辑运算的结果为 1 或 0
+OPERATIONS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b,
+    ">": lambda a, b: 1 if a > b else 0,
+    ">=": lambda a, b: 1 if a >= b else 0,
+    "<": lambda a, b: 1 if a < b else 0,
+    "<=": lambda a, b: 1 if a <= b else 0,
+    "==": lambda a, b: 1 if a == b else 0,
+    "!=": lambda a, b: 1 if a != b else 0,
+    "&&": lambda a, b: 1 if a and b else 0,
+    "||": lambda a, b: 1 if a or b else 0,
+}
+BOOL_OPERATORS = frozenset((">", ">=", "<", "<=", "==", "!=", "&&", "||"))  # 结果为 1 或 0 的运算符
+
+
+def fold_tree(tree):
+    """
+    折叠语法树中的二元表达式：
+    两个操作数都是常量时计算结果，除数为0时保留，运行时报错
+    x+0、0+x、x-0、x*1、1*x 化简为 x
+    x*0、0*x 在 x 没有副作用、不会出错且一定是整数时化简为 0
+    :param tree: 语法树
+    :return: 折叠的表达式节点数
+    """
+    nodes = [node for node in tree.walk() if node.kind == NodeKind.BINARY_EXPR]
+    facts = {}  # 未折叠的表达式节点 -> (是否没有副作用且不会出错, 结果是否一定是整数)
+    count = 0
+    for node in reversed(nodes):  # 先序的逆序，子表达式先于父表达式处理
+        left, right = node.sons
+        result = fold_node(node.payload, left, right, facts)
+        if result is None:
+            facts[node] = binary_facts(node, facts)
+            continue
+        if not isinstance(result, Node):
+            result = Node(NodeKind.NUM, None, node.line_num, result, True)
+        replace(node, result)
+        count += 1
+    return count
+
+
+def fold_node(operator, left, right, facts):
+    """
+    :return: 折叠结果，常量值或替代的子树，不能折叠时返回 None
+    """
+    left_value = constant(left)
+    right_value = constant(right)
+    if left_value is not None and right_value is not None:
+        if operator == "/" and right_value == 0:
+            return None  # 保留除以0，运行时报错
+        return OPERATIONS[operator](left_value, right_value)
+    if operator == "+":
+        if is_int(right_value, 0):
+            return left
+        if is_int(left_value, 0):
+            return right
+    elif operator == "-":
+        if is_int(right_value, 0):
+            return left
+    elif operator == "*":
+        if is_int(right_value, 1):
+            return left
+        if is_int(left_value, 1):
+            return right
+        if is_int(right_value, 0) and expression_facts(left, facts) == (True, True):
+            return 0
+        if is_int(left_value, 0) and expression_facts(right, facts) == (True, True):
+            return 0
+    return None
+
+
+def constant(node):
+    """
+    :return: 常量节点的值，不是常量时返回 None
+    """
+    return node.payload if node.kind == NodeKind.NUM else None
+
+
+def is_int(value, expected):
+    """
+    是否为指定的整数常量，浮点数常量参与运算会改变结果的类型
+    """
+    return type(value) is int and value == expected
+
+
+def expression_facts(node, facts):
+    """
+    :param facts: 已处理的表达式节点的结果
+    :return: (是否没有副作用且不会出错, 结果是否一定是整数)
+    """
+    kind = node.kind
+    if kind == NodeKind.NUM:
+        return True, type(node.payload) is int
+    if kind == NodeKind.ID:
+        return True, True  # 读取变量时转为整数
+    if kind == NodeKind.ID_STAT:
+        symbol = node.payload
+        return symbol.kind == "array" and node.sons[0].payload < symbol.size, True  # 下标错误在语义分析时报告
+    if kind == NodeKind.BINARY_EXPR:
+        return facts[node]
+    return False, False  # 赋值与函数调用有副作用，返回值可能是浮点数
+
+
+def binary_facts(node, facts):
+    """
+    :param facts: 已处理的表达式节点的结果，包含 node 的子表达式
+    :return: 未折叠的二元表达式的 (是否没有副作用且不会出错, 结果是否一定是整数)
+    """
+    if node.payload == "/":
+        return False, False  # 可能除以0，结果可能是浮点数
+    left_pure, left_int = expression_facts(node.sons[0], facts)
+    right_pure, right_int = expression_facts(node.sons[1], facts)
+    return left_pure and right_pure, node.payload in BOOL_OPERATORS or left_int and right_int
+
+
+def replace(node, new_node):
+    """
+    在父节点的子节点中用 new_node 替换 node
+    """
+    parent = node.parent
+    new_node.parent = parent
+    parent.sons = tuple(new_node if son is node else son for son in parent.sons)
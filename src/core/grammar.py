@@ -1,6 +1,4 @@
 # 语法分析程序
-from queue import Queue
-
 from .compile_error import (
     LACK_FUNCTION_BODY,
     LACK_FUNCTION_NAME,
@@ -14,8 +12,6 @@ from .compile_error import (
 
 __author__ = "mori"
 
-import re
-
 # 避免使用通配符导入，显式导入需要的异常类
 from .compile_error import (
     GrammarError,
@@ -33,36 +29,38 @@ from .compile_error import (
     LACK_CASE,
     LACK_COLON,
 )
-from .grammar_tree import GrammarTree as Tree
-from .signary import Scope
-
-LOGIC_RE = "^([<>!=]=)|&{2}|\\|{2}|[<>]$"  # 匹配逻辑运算符 <= >= != == < > || &&
-
-
-def new_scope(func):  # func为被包装的方法
-    """
-    包装器，用于为需要新建符号表的节点创建符号表以及符号表回溯，部分规则需要单独实现
-    """
-
-    def inner_wrapper(self, *args, **kwargs):
-        self.new_scope()  # 创建新的作用域（符号表）
-        result = func(self, *args, **kwargs)  # 执行被包装的方法
-        self.scope_back()  # 作用域回溯
-        return result
-
-    return inner_wrapper
-
-
-def tree_builder(node_name):
+from .grammar_tree import GrammarTree as Tree, NodeKind
+from .signary import Symbol, SymbolTable
+from .token import TokenCursor, TYPE_NAMES
+
+LOGIC_LEVEL = 1  # 逻辑运算符的优先级，最低
+PRECEDENCE = {  # 二元运算符优先级，数值越大结合越紧密
+    "<=": LOGIC_LEVEL,
+    ">=": LOGIC_LEVEL,
+    "!=": LOGIC_LEVEL,
+    "==": LOGIC_LEVEL,
+    "<": LOGIC_LEVEL,
+    ">": LOGIC_LEVEL,
+    "||": LOGIC_LEVEL,
+    "&&": LOGIC_LEVEL,
+    "+": 2,
+    "-": 2,
+    "*": 3,
+    "/": 3,
+}
+
+
+def tree_builder(kind):
     """
     包装器，用于每个节点的建树、语法树回溯操作
+    :param kind: 节点类别
     """
 
     def wrapper(func):  # func为被包装的方法
         def inner_wrapper(self, *args, **kwargs):
-            self.tree.new_node(node_name, self.line_num)
+            self.tree.new_node(kind, self.line_num)
             result = func(self, *args, **kwargs)
-            assert node_name == self.tree.now_node.value
+            assert kind == self.tree.now_node.kind
             self.tree.back()
             return result
 
@@ -76,20 +74,20 @@ class GrammarAnalyse:
     语法分析主类
     """
 
-    def __init__(self, file_in):
-        self.file_in = open(file_in, "r", encoding="utf-8")  # 打开单词流文件
+    def __init__(self, tokens):
+        """
+        :param tokens: 词法分析得到的 TokenStream，或流式词法分析的单词生成器
+        """
+        self.tokens = TokenCursor(tokens)
         self.line_num = 1  # 初始化行号
         self.word_type = ""  # 初始化读取字符
         self.word_value = ""
-        self.scope_id = 0
-        self.now_scope = None
-        self.__new_scope()  # 初始化作用域
-        self.__backtrace_queue = Queue()  # 回溯队列
+        self.symbols = SymbolTable()  # 符号表，标识符节点绑定解析到的符号
         self.tree = None  # 初始化语法树
+        self.unit_starts = []  # 顶层单元（全局变量、函数声明、主函数）的开始单词序号，与根节点的子节点对应
+        self.global_symbols = []  # 全局变量的符号
 
-    def __check_word(
-        self, to_pair, error_str, where, dynamic_name="", read=True, node=True
-    ):
+    def __check_word(self, to_pair, error_str, where, read=True, node=True):
         """
         校验字符串
         """
@@ -97,53 +95,103 @@ class GrammarAnalyse:
             self.__read_word()  # 读单词
         if self.word_type != to_pair:
             raise GrammarError(self.line_num, where, error_str)
-        node_name = (
-            dynamic_name.format(self.word_value) if dynamic_name else self.word_type
-        )
         if node:
-            self.tree.new_leaf(node_name, self.line_num)  # 节点名加入语法树
+            self.__word_leaf()  # 单词加入语法树
+
+    def __word_leaf(self):
+        """
+        当前单词作为叶节点插入语法树，整数保存为带载荷的节点，标识符节点由声明或引用处插入
+        """
+        word_type = self.word_type
+        if word_type == "NUM":
+            self.tree.new_leaf(int(self.word_value), self.line_num, NodeKind.NUM)
+        else:
+            self.tree.new_leaf(word_type, self.line_num)
 
     def program(self):
         """
         1. 分析规则：<program>::=<declaration_list>{fun_declaration}<main_declaration>
         <程序> => <全局变量>{<函数声明>}<主函数>
         """
-        self.tree = Tree("<程序>")  # 建树
+        self.tree = Tree(NodeKind.PROGRAM)  # 建树
         self.__read_word()
         if self.word_type == "int":
+            self.unit_starts.append(self.__word_index())
             self.__declaration_list()  # 全局变量声明
+        self.global_symbols = self.symbols.global_symbols()
         while self.word_type == "function":
+            self.unit_starts.append(self.__word_index())
             self.__fun_declaration()  # 分析函数声明
         if not self.word_type == "main":
             raise GrammarError(self.line_num, "<程序>", LACK_MAIN_DECL)
+        self.unit_starts.append(self.__word_index())
         self.__main_declaration()  # 分析主函数
+        self.__check_end()
+
+    def program_units(self, stop, global_symbols, functions):
+        """
+        增量分析：从单词流开头分析连续的函数声明与主函数，分析到第 stop 个单词为止
+        :param stop: 结束的单词序号，分析完一个单元后当前单词恰好位于此处才算对齐
+        :param global_symbols: 全局变量的符号，按声明顺序重新声明，地址不变
+        :param functions: 之前已声明的函数名
+        :return: 是否对齐，对齐时单元节点为根节点的子节点
+        """
+        self.tree = Tree(NodeKind.PROGRAM)  # 建树
+        for symbol in global_symbols:
+            self.symbols.declare(symbol)
+        self.global_symbols = global_symbols
+        for name in functions:
+            self.symbols.declare(Symbol(name, "function"))
+        self.__read_word()
+        while self.__word_index() < stop:
+            self.unit_starts.append(self.__word_index())
+            if self.word_type == "function":
+                self.__fun_declaration()  # 分析函数声明
+            elif self.word_type == "main":
+                self.__main_declaration()  # 分析主函数
+                self.__check_end()
+            else:
+                return False
+        return self.__word_index() == stop
+
+    def __check_end(self):
+        """
+        主函数之后不能有其他单词
+        """
         if self.word_type is not None:
             raise GrammarError(
                 self.line_num, "<程序>", UNEXPECTED_END.format(self.word_value)
             )
 
-    @tree_builder("<函数声明>")
+    def __word_index(self):
+        """
+        :return: 当前单词的序号，读完时为单词总数
+        """
+        position = self.tokens.position
+        return position if self.word_type is None else position - 1
+
+    @tree_builder(NodeKind.FUN_DECLARATION)
     def __fun_declaration(self):
         """
         2. 分析规则： <fun_declaration>::=function ID(<arguments_list>)<function_body>
         <函数声明>=>function <标识符>()<函数体>
         """
         self.tree.new_leaf(self.word_value, self.line_num)  # function节点
-        self.__check_word("ID", LACK_FUNCTION_NAME, "<函数声明>", "ID  {0}")  # 读函数名
-        if self.now_scope.put(self.word_value, "function"):
+        self.__check_word("ID", LACK_FUNCTION_NAME, "<函数声明>", node=False)  # 读函数名
+        if self.symbols.declare(self.__id_leaf("function")):
             raise GrammarError(
                 self.line_num, "<函数声明>", MULTIPLE_DECL.format(self.word_value)
             )
         self.__check_word("(", LACK_LEFT_PARE, "<函数声明>")  # 读取左括号
-        self.__new_scope()  # 为参数列表创建单独的一级作用域
+        self.symbols.enter(True)  # 为参数列表创建单独的一级作用域与函数栈帧
         self.__read_word()  # 读取参数列表
         self.__argument_list()  # 参数列表
         self.__check_word(")", LACK_RIGHT_PARE, "<函数声明>", read=False)  # 检查右括号
         self.__check_word("{", LACK_FUNCTION_BODY, "<函数声明>", node=False)  # 检查{
         self.__function_body()  # 分析函数体
-        self.now_scope = self.now_scope.previous  # 作用域回溯
+        self.symbols.exit()  # 作用域回溯
 
-    @tree_builder("<参数列表>")
+    @tree_builder(NodeKind.ARGUMENT_LIST)
     def __argument_list(self):
         """
         2.1 读取规则 <argument_list>::=<argument_stat>{, <argument_stat>}|ε
@@ -158,21 +206,21 @@ class GrammarAnalyse:
             self.__read_word()
             self.__argument_stat()
 
-    @tree_builder("<参数声明>")
+    @tree_builder(NodeKind.ARGUMENT_STAT)
     def __argument_stat(self):
         """
         2.2 读取规则 <argument_stat>::=int ID
         <参数声明> => int 标识符
         """
         self.tree.new_leaf("int", self.line_num)
-        self.__check_word("ID", LACK_ID, "<参数声明>", "ID  {0}")  # 读取标识符
-        if self.now_scope.put(self.word_value, "int"):  # 插入当前作用域
+        self.__check_word("ID", LACK_ID, "<参数声明>", node=False)  # 读取标识符
+        if self.symbols.declare(self.__id_leaf()):  # 插入当前作用域
             raise GrammarError(
                 self.line_num, "<参数声明>", MULTIPLE_DECL.format(self.word_value)
             )
         self.__read_word()  # 后续字符
 
-    @tree_builder("<主函数>")
+    @tree_builder(NodeKind.MAIN_DECLARATION)
     def __main_declaration(self):
         """
         3. 分析规则： <main_declaration>::=main()<function_body>
@@ -184,7 +232,7 @@ class GrammarAnalyse:
         self.__read_word()
         self.__function_body()
 
-    @tree_builder("<函数体>")
+    @tree_builder(NodeKind.FUNCTION_BODY)
     def __function_body(self):
         """
         4. 分析规则： <function_body>::={<declaration_list><statement_list>}
@@ -197,7 +245,7 @@ class GrammarAnalyse:
         self.__check_word("}", LACK_RIGHT_BRACE, "<函数体>", read=False)  # 读取}
         self.__read_word()  # 读取后续字符
 
-    @tree_builder("<return语句>")
+    @tree_builder(NodeKind.RETURN_STAT)
     def __return_stat(self):
         """
         4.1 分析规则： <return_stat>=>return <expression_stat>
@@ -209,7 +257,7 @@ class GrammarAnalyse:
         self.__check_word(";", LACK_SEMI, "<return语句>", read=False)  # 读取}
         self.__read_word()
 
-    @tree_builder("<声明序列>")
+    @tree_builder(NodeKind.DECLARATION_LIST)
     def __declaration_list(self):
         """
         5. 分析规则：<declaration_list>::=<declaration_list><declaration_stat>|ε
@@ -219,7 +267,7 @@ class GrammarAnalyse:
         while self.word_type == "int":
             self.__declaration_stat()  # 声明语句
 
-    @tree_builder("<声明语句>")
+    @tree_builder(NodeKind.DECLARATION_STAT)
     def __declaration_stat(self):
         """
         6. 分析规则：<declaration_stat>::=int ID;
@@ -236,14 +284,14 @@ class GrammarAnalyse:
         self.__check_word(";", LACK_SEMI, "<声明语句>", read=False)  # check ';'
         self.__read_word()  # 读取下一组
 
-    @tree_builder("<单一声明语句>")
+    @tree_builder(NodeKind.SIMPLE_DECLARATION)
     def __simple_declaration(self):
         """
         6.1 单一变量声明语句分析：<simple_declaration>::=ID[=<bool>]|ID[NUM][=<array_init>]
         """
         # check ID
-        self.__check_word("ID", LACK_ID, "<单一声明语句>", "ID  {0}", read=False)
-        id_name = self.word_value
+        self.__check_word("ID", LACK_ID, "<单一声明语句>", read=False, node=False)
+        symbol = self.__id_leaf()  # 初始化表达式之后才声明，表达式中的同名标识符为外层的声明
         self.__read_word()
         if self.word_type == "=":
             self.tree.new_leaf("=", self.line_num)
@@ -251,23 +299,20 @@ class GrammarAnalyse:
             self.__bool_expr()
         elif self.word_type == "[":  # 数组声明
             self.tree.new_leaf("[", self.line_num)
-            self.__check_word("NUM", LACK_NUM, "<单一声明语句>", "NUM  {0}")  # 读取NUM
+            self.__check_word("NUM", LACK_NUM, "<单一声明语句>")  # 读取NUM
+            symbol.kind = "array"
+            symbol.size = int(self.word_value)  # 数组长度
             self.__check_word("]", LACK_RIGHT_SQUARE, "<单一声明语句>")  # 读取]
             self.__read_word()
             if self.word_type == "=":
                 self.tree.new_leaf("=", self.line_num)
                 self.__array_init()
-            if self.now_scope.put(id_name, "array"):  # 插入当前作用域，array
-                raise GrammarError(
-                    self.line_num, "<单一声明语句>", MULTIPLE_DECL.format(id_name)
-                )
-            return
-        if self.now_scope.put(id_name, "int"):  # 插入当前作用域，int
+        if self.symbols.declare(symbol):  # 插入当前作用域
             raise GrammarError(
-                self.line_num, "<单一声明语句>", MULTIPLE_DECL.format(id_name)
+                self.line_num, "<单一声明语句>", MULTIPLE_DECL.format(symbol.name)
             )
 
-    @tree_builder("<数组初始化语句>")
+    @tree_builder(NodeKind.ARRAY_INIT)
     def __array_init(self):
         """
         6.2 数组元素初始化语句：<array_init_stat>::={{<表达式>{,<表达式>}}}
@@ -286,7 +331,7 @@ class GrammarAnalyse:
         self.__check_word("}", LACK_RIGHT_BRACE, "<数组初始化语句>", read=False)
         self.__read_word()
 
-    @tree_builder("<语句序列>")
+    @tree_builder(NodeKind.STATEMENT_LIST)
     def __statement_list(self, read_con_bre=False):
         """
         7. 分析规则：<statement_list>::=<statement_list><statement>|ε
@@ -300,7 +345,7 @@ class GrammarAnalyse:
         ):  # 以FOLLOW集元素为结束标志
             self.__statement(read_con_bre)
 
-    @tree_builder("<语句>")
+    @tree_builder(NodeKind.STATEMENT)
     def __statement(self, read_con_bre=False):
         """
         8. 分析规则<statement>::=<if_stat>|<while_stat>|<do_while_stat>|
@@ -352,7 +397,7 @@ class GrammarAnalyse:
                 self.line_num, "<语句>", UNRECOGNIZED_STATEMENT.format(self.word_type)
             )
 
-    @tree_builder("<break、continue语句>")
+    @tree_builder(NodeKind.BREAK_CONTINUE)
     def __break_continue(self):
         """
         8.1 分析break、continue语句 <break_continue> ::= break;
@@ -361,7 +406,7 @@ class GrammarAnalyse:
         self.__check_word(";", LACK_SEMI, "<break、continue语句>")
         self.__read_word()
 
-    @tree_builder("<switch语句>")
+    @tree_builder(NodeKind.SWITCH_STAT)
     def __switch_stat(self):
         """
         8.2 分析规则<switch_stat>::=switch(<expression>){{<case语句>}{<default语句>}}
@@ -380,18 +425,18 @@ class GrammarAnalyse:
         self.__check_word("}", LACK_RIGHT_BRACE, "<switch语句>", read=False)  # 检查}
         self.__read_word()
 
-    @tree_builder("<case语句>")
+    @tree_builder(NodeKind.CASE_STAT)
     def __case_stat(self):
         """
         8.2.1 分析规则：<case_stat>::=case NUM:<statement_list>
         """
         self.tree.new_leaf(self.word_value, self.line_num)
-        self.__check_word("NUM", LACK_NUM, "<case语句>", "NUM  {0}")  # 读取NUM
+        self.__check_word("NUM", LACK_NUM, "<case语句>")  # 读取NUM
         self.__check_word(":", LACK_COLON, "<case语句>")
         self.__read_word()
         self.__statement_list(True)  # 分析语句序列
 
-    @tree_builder("<default语句>")
+    @tree_builder(NodeKind.DEFAULT_STAT)
     def __default_stat(self):
         """
         8.2.2 分析规则：<default_stat>::=default:<statement_list>
@@ -401,7 +446,7 @@ class GrammarAnalyse:
         self.__read_word()
         self.__statement_list(True)  # 分析语句序列
 
-    @tree_builder("<if语句>")
+    @tree_builder(NodeKind.IF_STAT)
     def __if_stat(self):
         """
         9. 分析规则 <if_stat>::=if(<expression>)<statement>[else<statement>]
@@ -419,7 +464,7 @@ class GrammarAnalyse:
             self.__read_word()  # 预读字符
             self.__statement()  # statement语句分析
 
-    @tree_builder("<while语句>")
+    @tree_builder(NodeKind.WHILE_STAT)
     def __while_stat(self):
         """
         10. 分析规则 <while_stat>::=while(<expression>)<statement>
@@ -433,7 +478,7 @@ class GrammarAnalyse:
         self.__read_word()  # 读取后续字符
         self.__statement(True)  # statement语句分析
 
-    @tree_builder("<for语句>")
+    @tree_builder(NodeKind.FOR_STAT)
     def __for_stat(self):
         """
         11. 分析规则<for_stat>::=for(<expression>;<expression>;<expression>)<statement>
@@ -453,7 +498,7 @@ class GrammarAnalyse:
         self.__read_word()
         self.__statement(True)  # 分析循环体
 
-    @tree_builder("<write语句>")
+    @tree_builder(NodeKind.WRITE_STAT)
     def __write_expr(self):
         """
         12. 分析语句 <write_expr>::=write<expression>
@@ -465,19 +510,19 @@ class GrammarAnalyse:
         self.__check_word(";", LACK_SEMI, "<write语句>", read=False)
         self.__read_word()  # 读取后续字符
 
-    @tree_builder("<read语句>")
+    @tree_builder(NodeKind.READ_STAT)
     def __read_expr(self):
         """
         13. 分析语句 <read_expr>::=read ID;
         <read语句> => read <标识符>;
         """
         self.tree.new_leaf(self.word_value, self.line_num)
-        self.__check_word("ID", LACK_ID, "<read语句>", "ID:[{0}]", node=False)  # 读取ID
+        self.__check_word("ID", LACK_ID, "<read语句>", node=False)  # 读取ID
         self.__id_stat()  # 读取标识符表达式
         self.__check_word(";", LACK_SEMI, "<read语句>", read=False)  # 读取;
         self.__read_word()  # 读取到正确的标识符，读取后续字符
 
-    @tree_builder("<复合语句>")
+    @tree_builder(NodeKind.COMPOUND_STAT)
     def __compound_stat(self, read_con_bre=False):
         """
         14. 分析语句 <compound>::={<statement_list>}
@@ -489,7 +534,7 @@ class GrammarAnalyse:
         self.__check_word("}", LACK_RIGHT_BRACE, "<复合语句>", read=False)
         self.__read_word()  # 读取后续字符
 
-    @tree_builder("<表达式语句>")
+    @tree_builder(NodeKind.EXPRESSION_STAT)
     def __expression_stat(self):
         """
         15. 分析规则 <expression_stat>::=<expression>;|;
@@ -503,15 +548,15 @@ class GrammarAnalyse:
         self.__check_word(";", LACK_SEMI, "<表达式语句>", read=False)
         self.__read_word()  # 读取后续字符
 
-    @tree_builder("<call语句>")
+    @tree_builder(NodeKind.CALL_STAT)
     def __call_stat(self):
         """
         16. 分析规则：<call_stat>::=call ID({<call_arguments>})
         <call语句> => call<标识符>({<实参列表>})
         """
         self.tree.new_leaf("call", self.line_num)
-        self.__check_word("ID", LACK_ID, "<call语句>", "ID  {0}")  # 读取ID
-        self.__check_id_scope("<call语句>")  # 检查作用域
+        self.__check_word("ID", LACK_ID, "<call语句>", node=False)  # 读取ID
+        self.tree.new_leaf(self.__resolve("<call语句>"), self.line_num, NodeKind.ID)  # 绑定解析到的符号
         self.__check_word("(", LACK_LEFT_PARE, "<call语句>")  # 检查(
         self.__read_word()
         if self.word_type != ")":
@@ -522,7 +567,7 @@ class GrammarAnalyse:
         self.tree.new_leaf(")", self.line_num)
         self.__read_word()  # 预读
 
-    @tree_builder("<实参列表>")
+    @tree_builder(NodeKind.CALL_ARGUMENTS)
     def __call_arguments(self):
         """
         16.1 分析规则：<call_arguments> => <expression>{,<expression>}
@@ -534,50 +579,54 @@ class GrammarAnalyse:
             self.__read_word()
             self.__expression()
 
-    @tree_builder("<表达式>")
     def __expression(self):
         """
-        17. 分析规则 <expression>::=ID=<bool_expr>|<bool_expr>
-        <表达式> => ID=<布尔表达式>|<布尔表达式>
+        17. 分析规则 <expression>::=<ID_stat>=<bool_expr>|<bool_expr>
+        <表达式> => <标识符语句>=<布尔表达式>|<布尔表达式>
+        已建立的标识符语句节点根据之后是否为'='作为赋值目标或左操作数，不需要回溯
         """
-        if self.word_type == "ID":
-            identifier_name = self.word_value
-            index = self.__id_stat()
-            if self.word_type == "=":
-                self.__read_word()
-                self.tree.new_leaf("=", self.line_num)
-            else:  # 状态回溯，因为bool_expr可能是单独的标识符，这里的重叠导致回溯
-                if index == -1:
-                    self.__add_backtrace(
-                        self.word_type, self.word_value
-                    )  # 回溯，当前已读的数据，如果回溯深度只有一层，则可以不使用队列
-                    self.word_type = "ID"
-                    self.word_value = identifier_name  # 回溯第二层
-                else:
-                    self.__add_backtrace("[", "[")
-                    self.__add_backtrace("NUM", index)
-                    self.__add_backtrace("]", "]")
-                    self.__add_backtrace(
-                        self.word_type, self.word_value
-                    )  # 遇到数组时的回溯
-                    self.word_type = "ID"
-                    self.word_value = identifier_name  # 回溯第二层
-                self.tree.delete_node()  # 语法树剪枝
-        self.__bool_expr()  # bool_expr语句分析
-
-    @tree_builder("<布尔表达式>")
+        if self.word_type != "ID":
+            self.__bool_expr()
+            return
+        self.__id_stat()
+        if self.word_type == "=":
+            self.tree.wrap_last(NodeKind.ASSIGN_EXPR, self.line_num)  # 标识符语句作为赋值目标
+            self.__read_word()
+            self.__bool_expr()
+            self.tree.back()
+        else:
+            self.__binary_expr(LOGIC_LEVEL)  # 标识符语句作为左操作数
+
     def __bool_expr(self):
         """
         18. 分析规则 <bool_expr>::=<additive>|<additive_expr>(>|<|>=|<=|==|!=|&&|||<additive>)
         <布尔表达式> => <算术表达式>|<算术表达式>(> < >= <= == != && ||<算术表达式>)
+        20. <算术表达式> => <项> {(+|-)<项>}
+        21. <项> => <因子>{(*|/)<因子>}
+        按运算符优先级爬升分析，每个运算符一个节点
         """
-        self.__additive_expr()  # additive语句分析
-        if re.match(LOGIC_RE, self.word_type):
-            self.tree.new_leaf(self.word_value, self.line_num)
+        self.__factor()
+        self.__binary_expr(LOGIC_LEVEL)
+
+    def __binary_expr(self, min_level):
+        """
+        优先级爬升，当前节点的最后一个子节点为已分析的左操作数，合并优先级不低于 min_level 的运算符
+        运算符节点的载荷为运算符，子节点为左、右操作数
+        :param min_level: 可以合并的最低优先级
+        """
+        while True:
+            level = PRECEDENCE.get(self.word_type)
+            if level is None or level < min_level:
+                return
+            self.tree.wrap_last(NodeKind.BINARY_EXPR, self.line_num, self.word_type)  # 左操作数移入运算符节点
             self.__read_word()
-            self.__additive_expr()  # additive语句分析
+            self.__factor()
+            self.__binary_expr(level + 1)  # 右操作数只合并优先级更高的运算符，同级运算符左结合
+            self.tree.back()
+            if level == LOGIC_LEVEL:
+                return  # 布尔表达式中最多一个逻辑运算符
 
-    @tree_builder("<do-while语句>")
+    @tree_builder(NodeKind.DO_WHILE)
     def __do_while(self):
         """
         19. 分析规则 <do_while_stat> => do<statement>while(<expression>);
@@ -596,129 +645,85 @@ class GrammarAnalyse:
         self.__check_word(";", LACK_SEMI, "<do-while语句>")  # 读取;
         self.__read_word()
 
-    @tree_builder("<算术表达式>")
-    def __additive_expr(self):
-        """
-        20. 分析规则 <additive_expr>::=<term>{(+|-)<term>}
-        <算术表达式> => <项> {(+|-)<项>}
-        """
-        self.__term()  # term 语句分析
-        while self.word_type == "+" or self.word_type == "-":
-            self.tree.new_leaf(self.word_value, self.line_num)
-            self.__read_word()  # 预读字符
-            self.__term()  # term 语句分析
-
-    @tree_builder("<项>")
-    def __term(self):
-        """
-        21. 分析规则 <term>::=<factor>{(*|/)<factor>}
-        <项> => <因子>{(*|/)<因子>}
-        """
-        self.__factor()  # 因子语句分析
-        while self.word_type == "*" or self.word_type == "/":
-            self.tree.new_leaf(self.word_type, self.line_num)
-            self.__read_word()  # 预读字符
-            self.__factor()  # 因子语句分析
-
-    @tree_builder("<因子>")
     def __factor(self):
         """
         22. 分析规则 <factor>::=(<expression>)|NUM|<call_stat>|<ID_stat>
-        <因子> => (<表达式>)|<无符号整数>|<call语句>|
+        <因子> => (<表达式>)|<无符号整数>|<call语句>|<标识符语句>
+        因子不建立节点，括号内的表达式直接作为操作数
         """
         if self.word_type == "(":
-            self.tree.new_leaf("(", self.line_num)
             self.__read_word()
             self.__expression()
-            self.__check_word(")", LACK_RIGHT_PARE, "<因子>", read=False)
+            self.__check_word(")", LACK_RIGHT_PARE, "<因子>", read=False, node=False)
             self.__read_word()
-            return
         elif self.word_type == "call":
             self.__call_stat()  # 读取调用语句
-            return
-        elif not (self.word_type == "NUM" or self.word_type == "ID"):
-            raise GrammarError(self.line_num, "<因子>", LACK_OPERAND)
         elif self.word_type == "ID":
             self.__id_stat()  # 标识符语句
-            return
-        self.tree.new_leaf(
-            "{0}  {1}".format(self.word_type, self.word_value), self.line_num
-        )
-        self.__read_word()
+        elif self.word_type == "NUM":
+            self.__word_leaf()
+            self.__read_word()
+        else:
+            raise GrammarError(self.line_num, "<因子>", LACK_OPERAND)
 
-    @tree_builder("<标识符语句>")
     def __id_stat(self):
         """
         22.1 标识符语句 <ID_stat>::=ID|ID[NUM]
+        普通变量为标识符叶节点，数组元素为 <标识符语句> 节点，载荷为解析到的符号，子节点为下标
         """
-        self.tree.new_leaf(
-            "{0}  {1}".format(self.word_type, self.word_value), self.line_num
-        )
-        index = -1
-        self.__check_id_scope("标识符语句")
+        symbol = self.__resolve("标识符语句")
+        line_num = self.line_num
         self.__read_word()
-        if self.word_type == "[":  # 数组声明
-            self.tree.new_leaf("[", self.line_num)
-            self.__check_word("NUM", LACK_NUM, "<标识符语句>", "NUM  {0}")  # 读取NUM
-            index = self.word_value
-            self.__check_word("]", LACK_RIGHT_SQUARE, "<标识符语句>")  # 读取]
-            self.__read_word()
-        return index  # 数组下标
+        if self.word_type != "[":
+            self.tree.new_leaf(symbol, line_num, NodeKind.ID)
+            return
+        self.tree.new_node(NodeKind.ID_STAT, line_num, symbol)
+        self.__check_word("NUM", LACK_NUM, "<标识符语句>")  # 读取NUM
+        self.__check_word("]", LACK_RIGHT_SQUARE, "<标识符语句>", node=False)  # 读取]
+        self.__read_word()
+        self.tree.back()
 
     def __read_word(self):
         """
-        读取单词，处理多读取的换行符，并进行行号统计、作用域处理
+        读取单词，并进行行号统计、作用域处理
         :return: 是否读到字符，读到文件末尾时返回FALSE
         """
-        if not self.__backtrace_queue.empty():  # 读取回溯队列
-            now_line = self.__backtrace_queue.get()
-            self.word_type = now_line[0]
-            self.word_value = now_line[1]
-            return True
-        now_line = self.file_in.readline()
-        while now_line == "[enter]\n":
-            self.line_num += 1  # 遇到换行标记
-            now_line = self.file_in.readline()  # 读下一行
-        if now_line == "":
+        token = self.tokens.read()
+        if token is None:
+            self.line_num = self.tokens.end_line  # 文件末尾的换行也计入行号
             self.word_type = self.word_value = None
             return False
         else:
-            word_list = now_line.split()  # 切分并处理换行符
-            self.word_type = word_list[0]  # 单词类别
-            if self.word_type == "{":
-                self.__new_scope()  # 读取到'{'，创建新的作用域
-            elif self.word_type == "}":
-                previous = self.now_scope.previous
-                if previous is None:  # 已经回退到顶级作用域
+            type_id, self.word_value, self.line_num = token
+            self.word_type = word_type = TYPE_NAMES[type_id]  # 单词类别
+            if word_type == "{":
+                self.symbols.enter()  # 读取到'{'，创建新的作用域
+            elif word_type == "}":
+                if self.symbols.depth == 0:  # 已经回退到顶级作用域
                     raise GrammarError(self.line_num, "<程序>", UNEXPECTED_END)
-                self.now_scope = previous  # 读取到'}'，返回上移作用域
-            self.word_value = word_list[1]  # 单词值
+                self.symbols.exit()  # 读取到'}'，返回上移作用域
             return True
 
-    def __add_backtrace(self, word_type, word_value):
-        """
-        创建回溯元素
-        """
-        self.__backtrace_queue.put((word_type, word_value))
-
-    def close(self):
-        self.file_in.close()  # 关闭打开的文件
-
-    def __new_scope(self):
+    def __id_leaf(self, kind="int"):
         """
-        新建作用域
+        为当前标识符创建声明的符号，作为标识符叶节点插入语法树
+        :param kind: 符号类型
+        :return: 符号，由调用者声明
         """
-        self.now_scope = Scope(self.now_scope, self.scope_id)
-        self.scope_id += 1
+        symbol = Symbol(self.word_value, kind)
+        self.tree.new_leaf(symbol, self.line_num, NodeKind.ID)
+        return symbol
 
-    def __check_id_scope(self, where):
+    def __resolve(self, where):
         """
-        标识符作用域检查
+        标识符名字解析，查找最内层的声明
+        :return: 符号
         """
         if self.word_type != "ID":
             raise RuntimeError("不是标识符类型，无法进行作用域检查")
-        scope = self.now_scope.get_scope_str(self.word_value)
-        if scope is None:  # 作用域为None，说明没有声明
+        symbol = self.symbols.lookup(self.word_value)
+        if symbol is None:  # 没有声明
             raise GrammarError(
                 self.line_num, where, NO_STATEMENT.format(self.word_value)
             )
+        return symbol
@@ -1,5 +1,87 @@
 __author__ = 'mori'
 
+LEAF_SONS = ()  # 所有叶节点共用的空子节点序列
+PRINT_BUFFER = 4096  # 输出语法树时每次写入文件的行数
+
+
+class NodeKind:
+    """
+    节点类别，使用整数常量，叶节点的信息保存在节点载荷中
+    """
+
+    # 叶节点
+    TOKEN = 0  # 保留字、分界符，载荷为单词值
+    ID = 1  # 标识符，载荷为标识符名
+    NUM = 2  # 无符号整数，载荷为整数值
+    # 非终结符
+    PROGRAM = 3
+    FUN_DECLARATION = 4
+    ARGUMENT_LIST = 5
+    ARGUMENT_STAT = 6
+    MAIN_DECLARATION = 7
+    FUNCTION_BODY = 8
+    RETURN_STAT = 9
+    DECLARATION_LIST = 10
+    DECLARATION_STAT = 11
+    SIMPLE_DECLARATION = 12
+    ARRAY_INIT = 13
+    STATEMENT_LIST = 14
+    STATEMENT = 15
+    BREAK_CONTINUE = 16
+    SWITCH_STAT = 17
+    CASE_STAT = 18
+    DEFAULT_STAT = 19
+    IF_STAT = 20
+    WHILE_STAT = 21
+    FOR_STAT = 22
+    WRITE_STAT = 23
+    READ_STAT = 24
+    COMPOUND_STAT = 25
+    EXPRESSION_STAT = 26
+    CALL_STAT = 27
+    CALL_ARGUMENTS = 28
+    DO_WHILE = 29
+    ID_STAT = 30  # 数组元素，载荷为数组名，子节点为下标
+    BINARY_EXPR = 31  # 二元运算，载荷为运算符，子节点为左、右操作数
+    ASSIGN_EXPR = 32  # 赋值，子节点为赋值目标、布尔表达式
+
+
+KIND_NAMES = (  # 节点类别的显示名，用于输出语法树
+    "TOKEN",
+    "ID",
+    "NUM",
+    "<程序>",
+    "<函数声明>",
+    "<参数列表>",
+    "<参数声明>",
+    "<主函数>",
+    "<函数体>",
+    "<return语句>",
+    "<声明序列>",
+    "<声明语句>",
+    "<单一声明语句>",
+    "<数组初始化语句>",
+    "<语句序列>",
+    "<语句>",
+    "<break、continue语句>",
+    "<switch语句>",
+    "<case语句>",
+    "<default语句>",
+    "<if语句>",
+    "<while语句>",
+    "<for语句>",
+    "<write语句>",
+    "<read语句>",
+    "<复合语句>",
+    "<表达式语句>",
+    "<call语句>",
+    "<实参列表>",
+    "<do-while语句>",
+    "<标识符语句>",
+    "<二元表达式>",
+    "<赋值表达式>",
+)
+
 
 class GrammarTree:
     """
@@ -8,119 +90,173 @@ class GrammarTree:
 
     def __init__(self, root):
         self.now_node = self.root = Node(root, None, 1)  # 初始化根节点并进入根节点
-        self.iterator = None  # 初始化迭代器
 
-    def new_node(self, val, line_num):
+    def new_node(self, kind, line_num, payload=None):
         """
         新建并进入子节点
-        :param val: 子节点名
+        :param kind: 子节点类别
         :param line_num: 行号
+        :param payload: 子节点载荷
         """
-        new_node = Node(val, self.now_node, line_num)  # 创建子节点
+        new_node = Node(kind, self.now_node, line_num, payload)  # 创建子节点
         self.now_node.sons.append(new_node)  # 插入新节点
         self.now_node = new_node  # 进入子节点
 
-    def new_leaf(self, val, line_num):
+    def new_leaf(self, payload, line_num, kind=NodeKind.TOKEN):
         """
         新建并插入叶节点到当前节点
-        :param val: 子节点名
+        :param payload: 叶节点载荷，单词值、标识符名或整数值
+        :param line_num: 行号
+        :param kind: 叶节点类别
+        """
+        self.now_node.sons.append(Node(kind, self.now_node, line_num, payload, True))  # 插入叶节点
+
+    def wrap_last(self, kind, line_num, payload=None):
+        """
+        新建子节点替换当前节点的最后一个子节点，原节点成为新节点的第一个子节点，并进入新节点
+        用于运算符节点包裹已建立的左操作数
+        :param kind: 子节点类别
         :param line_num: 行号
+        :param payload: 子节点载荷
         """
-        self.now_node.sons.append(Node(val, self.now_node, line_num, True))  # 插入叶节点
+        now_node = self.now_node
+        son = now_node.sons.pop()
+        new_node = Node(kind, now_node, line_num, payload)
+        son.parent = new_node
+        new_node.sons.append(son)
+        now_node.sons.append(new_node)
+        self.now_node = new_node
 
     def back(self):
         """
         返回上一级节点
         """
-        if self.now_node.parent is None:
+        now_node = self.now_node
+        if now_node.parent is None:
             raise RuntimeError('已回溯至根节点，无法继续回溯')
-        self.now_node = self.now_node.parent
+        if now_node.sons:
+            now_node.sons = tuple(now_node.sons)  # 子树构建完成，子节点转为紧凑的元组
+        self.now_node = now_node.parent
 
-    def print_tree(self):
+    def print_tree(self, file_out='out/grammar.o'):
         """
-        打印语法树，深度优先搜索
+        输出语法树，先序遍历，按块写入文件
+        :param file_out: 输出文件名
         """
-        out_file = open('out/grammar.o', 'w+', encoding='utf-8')  # 初始化语法树输出文件
-        print_all(self.root, out_file)
+        with open(file_out, 'w+', encoding='utf-8') as out_file:
+            print_all(self.root, out_file)
         if self.now_node is not self.root:
             raise RuntimeError("语法树未回溯至根节点，请检查语法结构")
 
-    def delete_node(self):
-        """
-        从当前节点的子节点栈中删除一个节点，深度回溯时将导致错误
-        """
-        self.now_node.sons.pop()
-
-    def next_node(self):
-        """
-        迭代器指针移动到下一个节点，可以为叶子节点，或者分支接点
-        """
-        if self.iterator is None:  # 开始迭代，从根节点开始
-            self.iterator = self.root
-        elif self.iterator.iter_index < len(self.iterator.sons):  # 迭代子节点数组
-            now_index = self.iterator.iter_index
-            self.iterator.iter_index += 1  # 迭代索引下移
-            self.iterator = self.iterator.sons[now_index]  # 移到带下一个节点
-        else:
-            self.iterator = self.iterator.parent  # 回溯
-            if self.iterator:
-                return self.next_node()  # 递归回溯，支持循环迭代
-            else:
-                return None
-        return self.iterator
-
-    @DeprecationWarning
-    def last_node(self):
+    def walk(self, node=None):
         """
-        迭代器返回到上一个节点，启用
+        先序遍历子树，使用显式栈，不修改节点，同一棵树可以同时进行多次遍历
+        :param node: 子树根节点，None 时为整棵树
+        :return: 生成器，按先序产出节点
         """
-        if self.iterator.parent is None:
-            self.iterator = None
-            return None  # 回溯到顶节点，再次回溯则报错
-        if self.iterator.parent.iter_index <= 1:  # 返回到本层首节点
-            self.iterator = self.iterator.parent  # 回溯一次
-            self.iterator.iter_index -= 1
-        else:  # 普通情况
-            parent = self.iterator.parent  # 本层父节点
-            parent.iter_index -= 1  # 父节点索引回退
-            result = parent.sons[parent.iter_index - 1]
-            while not result.leaf:
-                result.iter_index -= 1  # 移动索引到结尾
-                result = result.sons[result.iter_index]  # 移到本层尾节点
-            self.iterator = result
-        return self.iterator
+        stack = [self.root if node is None else node]
+        pop = stack.pop
+        extend = stack.extend
+        while stack:
+            node = pop()
+            yield node
+            if node.sons:
+                extend(reversed(node.sons))
 
 
 class Node:
     """
-    节点类
+    节点类，使用 __slots__ 减少每个节点的内存占用
     """
 
-    def __init__(self, value, parent, line_num, leaf=False):
-        self.leaf = leaf  # 是否叶子节点
-        self.value = value  # 节点显示名
-        self.sons = []  # 后代节点
+    __slots__ = ("kind", "payload", "sons", "parent", "line_num")
+
+    def __init__(self, kind, parent, line_num, payload=None, leaf=False):
+        self.kind = kind  # 节点类别
+        self.payload = payload  # 叶节点载荷，非终结符为 None
+        self.sons = LEAF_SONS if leaf else []  # 后代节点，叶节点共用空元组
         self.parent = parent  # 父节点
         self.line_num = line_num
-        self.depth = 0 if parent is None else parent.depth + 1   # 节点深度，父节点+1或0
-        self.iter_index = 0  # 迭代到的子节点栈索引，供语法树的迭代器使用
 
-    def print_node(self, out_file):
+    @property
+    def value(self):
+        """
+        节点显示名，仅用于输出语法树
+        """
+        kind = self.kind
+        if kind == NodeKind.TOKEN:
+            return self.payload
+        if self.payload is None:
+            return KIND_NAMES[kind]
+        return "{0}  {1}".format(KIND_NAMES[kind], self.payload)
+
+    @property
+    def leaf(self):
+        """
+        是否叶子节点
+        """
+        return self.sons is LEAF_SONS
+
+    @property
+    def depth(self):
+        """
+        节点深度，根节点为0，不再逐节点保存
+        """
+        depth = 0
+        node = self.parent
+        while node is not None:
+            depth += 1
+            node = node.parent
+        return depth
+
+    def print_node(self, out_file, depth=None):
         """
         打印当前节点
+        :param depth: 节点深度，None 时沿父节点计算
         """
+        if depth is None:
+            depth = self.depth
         node_type = '\033[4;33;0m▷·· ' if self.leaf else '\033[4;35;0m▼~'  # 控制台输出
-        # print("\033[0;36;0m| " * self.depth, node_type, self.value, sep='')  # 备用字符 TODO 控制台输出语法树
-        node_type = '▷·· ' if self.leaf else '▼~'  # 文件输出
-        out_file.write("| " * self.depth+node_type + self.value + '\n')
+        # print("\033[0;36;0m| " * depth, node_type, self.value, sep='')  # 备用字符 TODO 控制台输出语法树
+        out_file.write(self.tree_line(depth))  # 文件输出
+
+    def tree_line(self, depth):
+        """
+        :param depth: 节点深度
+        :return: 节点在语法树输出文件中的一行
+        """
+        node_type = '▷·· ' if self.leaf else '▼~'
+        return "| " * depth + node_type + self.value + '\n'
+
+
+def walk_depth(now_node, depth=0):
+    """
+    先序遍历子树，使用显式栈，深度随遍历传递
+    :param now_node: 子树根节点
+    :param depth: 子树根节点的深度
+    :return: 生成器，产出 (节点, 深度)
+    """
+    stack = [(now_node, depth)]
+    pop = stack.pop
+    while stack:
+        node, depth = pop()
+        yield node, depth
+        if node.sons:
+            depth += 1
+            stack.extend((son, depth) for son in reversed(node.sons))
 
 
-def print_all(now_node, out_file):
+def print_all(now_node, out_file, depth=0):
     """
-    递归输出子树结构，深度优先搜索
+    输出子树结构，先序遍历，缓冲 PRINT_BUFFER 行后整块写入
     :param now_node: 子树根节点
     :param out_file: 输出文件
+    :param depth: 子树根节点的深度
     """
-    now_node.print_node(out_file)
-    for index, item in enumerate(now_node.sons):
-        print_all(item, out_file)
+    lines = []
+    for node, depth in walk_depth(now_node, depth):
+        lines.append(node.tree_line(depth))
+        if len(lines) >= PRINT_BUFFER:
+            out_file.writelines(lines)
+            lines.clear()
+    out_file.writelines(lines)
@@ -0,0 +1,289 @@
+# 增量前端：保存上次的源代码文本、单词流与语法树，源代码修改后只重新分析受影响的部分
+import hashlib
+import os
+import pickle
+from array import array
+from bisect import bisect_left
+
+from . import __version__
+from .grammar import GrammarAnalyse
+from .grammar_tree import GrammarTree, Node, NodeKind
+from .lexical import LexicalAnalyse
+from .token import TokenStream
+
+__author__ = "mori"
+
+DEFAULT_DIR = "out/incremental"
+
+
+def common_prefix(a, b):
+    """
+    二分查找最长公共前缀的长度，切片比较在 C 中完成
+    """
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def common_suffix(a, b, limit):
+    """
+    最长公共后缀的长度，不超过 limit
+    """
+    low, high = 0, min(len(a), len(b), limit)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len(a) - mid:len(a) - low] == b[len(b) - mid:len(b) - low]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def splice_tokens(old, head, new, tail, char_delta, line_delta):
+    """
+    拼接单词流：old 的前 head 个单词 + new + old 从 tail 开始的单词（位置与行号平移）
+    """
+    res = TokenStream()
+    res.types = old.types[:head] + new.types + old.types[tail:]
+    res.values = old.values[:head] + new.values + old.values[tail:]
+    res.lines = old.lines[:head] + new.lines + array("I", (line + line_delta for line in old.lines[tail:]))
+    res.starts = old.starts[:head] + new.starts + array("I", (start + char_delta for start in old.starts[tail:]))
+    res.end_line = old.end_line + line_delta if tail < len(old) else new.end_line
+    return res
+
+
+def shift_lines(node, line_delta):
+    """
+    复用子树前平移所有节点的行号
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        node.line_num += line_delta
+        stack.extend(node.sons)
+
+
+def flatten(tree):
+    """
+    语法树按先序展开为并列的序列，序列化比逐个节点对象快得多
+    :return: 节点类别、载荷、行号、是否叶节点、子节点数
+    """
+    kinds = bytearray()
+    payloads = []
+    lines = array("I")
+    leaves = bytearray()
+    sizes = array("I")
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        kinds.append(node.kind)
+        payloads.append(node.payload)
+        lines.append(node.line_num)
+        leaves.append(node.leaf)
+        sizes.append(len(node.sons))
+        stack.extend(reversed(node.sons))
+    return bytes(kinds), payloads, lines, bytes(leaves), sizes
+
+
+def unflatten(flat):
+    """
+    由 flatten 的结果重建语法树
+    """
+    kinds, payloads, lines, leaves, sizes = flat
+    tree = GrammarTree(kinds[0])
+    tree.root.line_num = lines[0]
+    stack = [(tree.root, sizes[0])]  # (父节点, 剩余子节点数)
+    for index in range(1, len(kinds)):
+        parent, remain = stack[-1]
+        node = Node(kinds[index], parent, lines[index], payloads[index], bool(leaves[index]))
+        parent.sons.append(node)
+        if remain == 1:
+            stack.pop()
+        else:
+            stack[-1] = (parent, remain - 1)
+        if sizes[index]:
+            stack.append((node, sizes[index]))
+    return tree
+
+
+def function_name(node):
+    """
+    :return: <函数声明> 节点的函数名，其他单元为节点类别
+    """
+    if node.kind == NodeKind.FUN_DECLARATION:
+        return node.sons[1].payload.name  # function 之后的函数名叶节点，载荷为函数的符号
+    return node.kind
+
+
+class IncrementalFrontend:
+    """
+    增量前端，按源文件路径保存上次成功分析的结果，同一进程内多次编译时直接使用内存中的结果
+    单词以在源代码文本中的位置为键，每个字符对应一个 MIDI 和弦
+    """
+
+    def __init__(self, state_dir=DEFAULT_DIR):
+        """
+        :param state_dir: 分析结果的保存目录，None 表示只保存在内存中
+        """
+        self.state_dir = state_dir
+        self.states = {}  # 源文件绝对路径 -> 上次的分析结果
+        self.lexer = None
+        self.tokens = None
+        self.__path = None
+        self.__state = None
+        # 重新切分的范围：前 head 个单词不变，旧单词流从 tail 开始平移复用
+        self.head = 0
+        self.tail = 0
+        self.line_delta = 0
+
+    def lex(self, midi_path):
+        """
+        词法分析，只重新切分修改过的部分
+        :param midi_path: MIDI 文件名
+        :return: 单词流
+        """
+        self.__path = os.path.abspath(midi_path)
+        self.lexer = lexer = LexicalAnalyse(midi_path)
+        state = self.__state = self.__load()
+        if state is None:
+            self.tokens = lexer.analyse()
+        else:
+            self.tokens = self.__relex(state["text"], state["tokens"])
+        lexer.close()
+        return self.tokens
+
+    def __relex(self, old_text, old_tokens):
+        text = self.lexer.text
+        prefix = common_prefix(old_text, text)
+        suffix = common_suffix(old_text, text, min(len(old_text), len(text)) - prefix)
+        char_delta = len(text) - len(old_text)
+        damage_end = len(text) - suffix  # 新文本中修改部分的结束位置
+        # 读取范围（含结束位置的预读字符）都在修改位置之前的单词不受影响，二分查找第一个受影响的单词
+        low, high = 0, len(old_tokens)
+        while low < high:
+            mid = (low + high) // 2
+            if old_tokens.stop(mid) < prefix:
+                low = mid + 1
+            else:
+                high = mid
+        head = low
+        start = old_tokens.stop(head - 1) if head else 0  # 从最后一个不受影响的单词之后开始切分
+        tail = None
+
+        def resync(pos):
+            # 修改部分之后的单词开始位置与旧单词流中的某个单词对齐时，之后的切分结果相同
+            nonlocal tail
+            if pos < damage_end:
+                return False
+            index = bisect_left(old_tokens.starts, pos - char_delta, head)
+            if index < len(old_tokens) and old_tokens.starts[index] == pos - char_delta:
+                tail = index
+                return True
+            return False
+
+        new_tokens = self.lexer.analyse_from(start, resync)
+        self.head = head
+        if tail is None:
+            tail = len(old_tokens)
+        self.tail = tail
+        self.line_delta = text.count("\n") - old_text.count("\n")
+        return splice_tokens(old_tokens, head, new_tokens, tail, char_delta, self.line_delta)
+
+    def parse(self):
+        """
+        语法分析，只重新分析与修改部分相交的顶层单元，无法对齐时全部重新分析
+        :return: 语法树
+        """
+        tree = unit_starts = global_symbols = None
+        if self.__state is not None:
+            res = self.__reparse()
+            if res is not None:
+                tree, unit_starts, global_symbols = res
+        if tree is None:
+            grammar_exe = GrammarAnalyse(self.tokens)
+            grammar_exe.program()
+            tree, unit_starts, global_symbols = grammar_exe.tree, grammar_exe.unit_starts, grammar_exe.global_symbols
+        if self.lexer.error_count == 0:  # 只保存没有错误的结果
+            self.__save({
+                "text": self.lexer.text,
+                "tokens": self.tokens,
+                "tree": tree,
+                "unit_starts": unit_starts,
+                "global_symbols": global_symbols,
+            })
+        return tree
+
+    def __reparse(self):
+        """
+        :return: (语法树, 单元开始序号, 全局符号表)，无法增量分析时返回 None
+        """
+        state = self.__state
+        tree = state["tree"]
+        starts = state["unit_starts"]
+        units = tree.root.sons
+        old_count = len(state["tokens"])
+        head, tail = self.head, self.tail
+        shift = len(self.tokens) - old_count  # 复用单词的序号平移
+        ends = starts[1:] + [old_count]
+        # 与修改范围相交（含相邻）的单元
+        damaged = [i for i in range(len(units)) if starts[i] <= tail and ends[i] >= head]
+        if not damaged or units[damaged[0]].kind == NodeKind.DECLARATION_LIST:
+            return None  # 全局变量影响所有单元
+        first, last = damaged[0], damaged[-1]
+        stop = ends[last] + shift
+        functions = [function_name(node) for node in units[:first] if node.value == "<函数声明>"]
+        grammar_exe = GrammarAnalyse(self.tokens.iter_from(starts[first]))
+        if not grammar_exe.program_units(stop - starts[first], state["global_symbols"], functions):
+            return None
+        new_units = grammar_exe.tree.root.sons
+        if [function_name(node) for node in new_units] != [function_name(units[i]) for i in damaged]:
+            return None  # 函数的个数或名称变化，之后的单元需要重新检查
+        for node in new_units:
+            node.parent = tree.root
+        if self.line_delta:
+            for node in units[last + 1:]:
+                shift_lines(node, self.line_delta)
+        tree.root.sons = units[:first] + new_units + units[last + 1:]
+        new_starts = (
+            starts[:first]
+            + [start + starts[first] for start in grammar_exe.unit_starts]
+            + [start + shift for start in starts[last + 1:]]
+        )
+        return tree, new_starts, state["global_symbols"]
+
+    def __state_file(self):
+        name = hashlib.sha256(self.__path.encode()).hexdigest()
+        return os.path.join(self.state_dir, name + ".pickle")
+
+    def __load(self):
+        """
+        读取上次的分析结果，优先使用内存中的结果
+        """
+        state = self.states.get(self.__path)
+        if state is not None or self.state_dir is None:
+            return state
+        try:
+            with open(self.__state_file(), "rb") as file:
+                state = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if state.get("version") != __version__:
+            return None
+        state["tree"] = unflatten(state["tree"])
+        return state
+
+    def __save(self, state):
+        self.states[self.__path] = state
+        if self.state_dir is None:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        state_file = self.__state_file()
+        temp_file = state_file + ".tmp"
+        with open(temp_file, "wb") as file:
+            pickle.dump(dict(state, version=__version__, tree=flatten(state["tree"])), file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, state_file)
@@ -0,0 +1,171 @@
+# 中间代码：语义分析生成的虚拟机指令序列，虚拟机直接执行，文本清单仅用于查看
+from array import array
+
+__author__ = "mori"
+
+DUMP_FILE = "out/semantic.o"
+
+
+class Op:
+    """
+    操作码，使用整数常量，操作数均为整数
+    """
+
+    LABEL = 0  # 标号伪指令，操作数为标号编号
+    BR = 1  # 无条件转移，操作数为标号编号
+    BRF = 2  # 出栈，为假时转移
+    JSR = 3  # 调用函数，操作数为函数的标号编号
+    RET = 4  # 函数返回，操作数为返回值在栈帧中的相对地址
+    ALLOCATE = 5  # 申请函数栈帧，操作数为空间大小
+    STO = 6  # 栈顶写入绝对地址，不出栈
+    STO_LOCAL = 7  # 栈顶写入栈帧中的相对地址，不出栈
+    LOAD = 8  # 绝对地址的数据压栈
+    LOAD_LOCAL = 9  # 栈帧中相对地址的数据压栈
+    LOADI = 10  # 常量压栈
+    POP = 11
+    IN = 12
+    OUT = 13
+    ADD = 14
+    SUB = 15
+    MULT = 16
+    DIV = 17
+    EQ = 18
+    NOTEQ = 19
+    GT = 20
+    LES = 21
+    GE = 22
+    LE = 23
+    AND = 24
+    OR = 25
+    NOT = 26
+    STOP = 27
+
+
+OP_NAMES = (  # 操作码名称，虚拟机按名称查找指令的实现
+    "LABEL",
+    "BR",
+    "BRF",
+    "JSR",
+    "RET",
+    "ALLOCATE",
+    "STO",
+    "STO_LOCAL",
+    "LOAD",
+    "LOAD_LOCAL",
+    "LOADI",
+    "POP",
+    "IN",
+    "OUT",
+    "ADD",
+    "SUB",
+    "MULT",
+    "DIV",
+    "EQ",
+    "NOTEQ",
+    "GT",
+    "LES",
+    "GE",
+    "LE",
+    "AND",
+    "OR",
+    "NOT",
+    "STOP",
+)
+
+JUMP_OPS = (Op.BR, Op.BRF, Op.JSR)  # 操作数为标号的指令，链接后为目标指令的序号
+
+OPERAND_FORMATS = {  # 有操作数的指令在文本清单中的操作数格式，相对地址以':'开头
+    Op.BR: "LABEL{}",
+    Op.BRF: "LABEL{}",
+    Op.JSR: "LABEL{}",
+    Op.RET: ":{}",
+    Op.ALLOCATE: "{}",
+    Op.STO: "{}",
+    Op.STO_LOCAL: ":{}",
+    Op.LOAD: "{}",
+    Op.LOAD_LOCAL: ":{}",
+    Op.LOADI: "{}",
+}
+
+
+def listing_line(op, arg, linked=False):
+    """
+    :param linked: 是否链接后的指令，链接后转移目标显示为指令序号
+    :return: 指令在文本清单中的一行
+    """
+    if op == Op.LABEL:
+        return "LABEL{}:\n".format(arg)
+    operand_format = "{}" if linked and op in JUMP_OPS else OPERAND_FORMATS.get(op)
+    operand = "" if operand_format is None else operand_format.format(arg)
+    name = OP_NAMES[op].replace("_LOCAL", "")  # 相对寻址的指令与绝对寻址的指令同名
+    return "    {0:10}{1}\n".format(name, operand)
+
+
+class Program:
+    """
+    虚拟机程序，指令的操作码、操作数、源代码行号分别保存在并列的序列中
+    """
+
+    def __init__(self):
+        self.ops = array("B")  # 操作码
+        self.args = []  # 操作数，没有操作数的指令为0
+        self.lines = array("I")  # 生成指令时所在的源代码行号
+        self.linked = False  # 是否已链接：没有标号伪指令，转移目标为指令序号
+        self.functions = {}  # 函数名 -> (入口标号, 参数个数)，链接后入口为指令序号
+
+    def emit(self, op, arg=0, line_num=0):
+        """
+        追加指令
+        :param op: 操作码
+        :param arg: 操作数
+        :param line_num: 源代码行号
+        """
+        self.ops.append(op)
+        self.args.append(arg)
+        self.lines.append(line_num)
+
+    def insert(self, index, op, arg=0, line_num=0):
+        """
+        在指定位置插入指令
+        :param index: 插入位置
+        """
+        self.ops.insert(index, op)
+        self.args.insert(index, arg)
+        self.lines.insert(index, line_num)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def dump(self, file_out=DUMP_FILE):
+        """
+        按文本格式输出指令清单，每条指令一行
+        :param file_out: 输出文件名
+        :return: 输出文件名
+        """
+        linked = self.linked
+        with open(file_out, "w+", encoding="utf-8") as out_file:
+            out_file.writelines(listing_line(op, arg, linked) for op, arg in zip(self.ops, self.args))
+        return file_out
+
+    def link(self):
+        """
+        链接：删除标号伪指令，转移与调用指令的操作数改为目标指令的序号
+        :return: 链接后的程序
+        """
+        targets = {}  # 标号编号 -> 删除标号后的指令序号
+        count = 0
+        for op, arg in zip(self.ops, self.args):
+            if op == Op.LABEL:
+                targets[arg] = count
+            else:
+                count += 1
+        linked = Program()
+        linked.linked = True
+        linked.functions = {name: (targets[entry], par_num) for name, (entry, par_num) in self.functions.items()}
+        for op, arg, line_num in zip(self.ops, self.args, self.lines):
+            if op == Op.LABEL:
+                continue
+            if op in JUMP_OPS:
+                arg = targets.get(arg)  # 没有目标的转移（如 switch 中的 continue）执行到时才报错
+            linked.emit(op, arg, line_num)
+        return linked
@@ -3,10 +3,12 @@ __author__ = "mori"
 
 import os
 import re
+import sys
 
-from ..midi.midi_reader import MidiReader
+from ..midi.midi_reader import CHUNK_SIZE, MidiReader
 
 from .compile_error import LexicalError
+from .token import TokenStream, TYPE_IDS
 
 LETTER_RE = "^[a-zA-Z]$"  # 匹配单字母
 DIGIT_RE = "^\\d$"  # 匹配单数字
@@ -17,13 +19,23 @@ IDENTIFIER_RE = (
     "^[a-z|A-Z][a-z|A-Z|\\d]*$"  # 匹配合法标识符：字母开头，字母数字的任意组合为结尾
 )
 
+# 字符类别，词法分析时按类别查表转移，不再逐字符匹配正则表达式
+C_SPACE = 0  # 空格、制表符
+C_NEWLINE = 1  # 换行符
+C_ILLEGAL = 2  # 非法字符
+C_LETTER = 3  # 字母
+C_DIGIT = 4  # 数字
+C_SINGLE = 5  # 单分界符 +-*(){}:;,[]
+C_COMPARE = 6  # <>!=，可以与后接的 = 组成双分界符
+C_LOGIC = 7  # &|，必须成对出现
+C_SLASH = 8  # /，除号或注释开始
+C_END = 9  # \0，文件结束符
 
-class LexicalAnalyse:
-    """
-    词法分析主类
-    """
+NUMBER_END = frozenset((C_SPACE, C_NEWLINE, C_SINGLE, C_COMPARE, C_LOGIC))  # 可以结束数字的字符类别
+IDENTIFIER_PART = frozenset((C_LETTER, C_DIGIT))  # 标识符可以包含的字符类别
 
-    __keyword = [
+KEYWORDS = frozenset(
+    (
         "if",
         "else",
         "for",
@@ -39,24 +51,87 @@ class LexicalAnalyse:
         "function",
         "main",
         "return",
-        "call",
         "break",
         "continue",
-    ]  # 保留字
+    )
+)  # 保留字
+
+
+def char_class(char):
+    """
+    按原有的正则表达式求单个字符的类别
+    :param char: 字符
+    :return: 字符类别
+    """
+    if char == " " or char == "\t":
+        return C_SPACE
+    if char == "\n":
+        return C_NEWLINE
+    if re.match(LETTER_RE, char):
+        return C_LETTER
+    if re.match(DOUBLE_ST_RE, char):
+        return C_COMPARE if re.match(SINGLE_RE, char) else C_LOGIC
+    if re.match(SINGLE_RE, char):
+        return C_SINGLE
+    if re.match(DIGIT_RE, char):
+        return C_DIGIT
+    if char == "/":
+        return C_SLASH
+    if char == "\0":
+        return C_END
+    return C_ILLEGAL
+
+
+CHAR_CLASS = bytes(char_class(chr(i)) for i in range(256))  # 字节 -> 字符类别，用于 bytes.translate
+
+
+class LexicalAnalyse:
+    """
+    词法分析主类
+    轨道解码到内存缓冲区后，按字符类别表驱动的状态机切分单词
+    行号统计延迟到输出单词或报错前进行，与逐字符读取时的行号一致
+    各单词读取函数返回下一个待读取的位置；流式分析时单词可能延续到下一块，此时返回 None
+    """
 
-    def __init__(self, file_in):
+    def __init__(self, file_in, stream=False):
         """
         构造
         :param file_in: 传入的 MIDI 文件名
+        :param stream: 是否流式分析，为真时由 iter_tokens 逐块解码，否则一次解码整个轨道
         """
         if os.path.exists(file_in):
             self.new_id = False  # 新读取ID的标记，读取到int时值为true
-            self.midi_reader = iter(MidiReader(file_in))
+            self.midi_reader = MidiReader(file_in)
+            if stream:
+                data = b""
+            else:
+                # 整个轨道一次解码为连续的字符缓冲区，字节按 latin-1 一一映射为字符
+                data = self.midi_reader.read_all()
+            self.text = data.decode("latin-1")
+            self.__classes = data.translate(CHAR_CLASS)  # 每个字符的类别
+            self.__start = 0  # 缓冲区中下一个待读取的位置
+            self.__final = True  # 缓冲区之后是否没有更多字符
+            self.__pos = 0  # 发生错误时最后读取的字符位置
+            self.__synced = 0  # 已统计换行的位置
+            self.error_count = 0  # 词法错误数
             self.line_num = 1  # 初始化行号
-            self.__keyword.sort()  # 保留字排序，用于二分查找
-            file_out = "out/lexical.o"
-            self.out_file = open(file_out, "w+", encoding="utf-8")
-            self.out_filename = file_out  # 保存输出文件名
+            self.tokens = TokenStream()  # 单词流
+            self.__pending = []  # 流式分析时当前块识别出的单词
+            self.__comment = None  # 流式分析时注释延续到下一块：已读取的内容中是否出现了/*，不在注释中时为 None
+            self.__emit = self.tokens.append
+            # 字符类别 -> 单词读取函数，空白与文件结束符在主循环中处理
+            self.__readers = (
+                None,
+                None,
+                self.__read_illegal,
+                self.__read_identifier,
+                self.__read_digit,
+                self.__read_single,
+                self.__read_compare,
+                self.__read_logic,
+                self.__read_comment,
+                None,
+            )
         else:
             raise FileNotFoundError("找不到指定的文件")
 
@@ -64,176 +139,279 @@ class LexicalAnalyse:
         """
         词法分析主函数
         """
-        temp_char = self.__read_char()
-        while temp_char != "":
+        self.__scan()
+        self.tokens.end_line = self.line_num
+        return self.tokens  # 返回单词流
+
+    def iter_tokens(self, chunk_size=CHUNK_SIZE):
+        """
+        流式词法分析：逐块解码 MIDI 轨道，每块切分完后产出已识别的单词
+        缓冲区只保留尚未切分完的单词，词法错误在读到时立即输出
+        :param chunk_size: 每块的和弦数
+        :return: 生成器，产出 (单词类别编号, 单词值, 行号)，结束时返回最后的行号
+        """
+        self.__emit = self.__append_pending
+        pending = self.__pending
+        finished = False
+        for data in self.midi_reader.read_chunks(chunk_size):
+            self.__feed(data)
+            finished = self.__scan(final=False)
+            yield from pending
+            pending.clear()
+            if finished:
+                break
+        if not finished:
+            self.__scan()
+            yield from pending
+            pending.clear()
+        return self.line_num
+
+    def __feed(self, data):
+        """
+        丢弃缓冲区中已读取的字符，追加新解码的一块
+        """
+        start = self.__start
+        self.text = self.text[start:] + data.decode("latin-1")
+        self.__classes = self.__classes[start:] + data.translate(CHAR_CLASS)
+        self.__synced = max(self.__synced - start, 0)
+        self.__start = 0
+
+    def analyse_from(self, start, resync):
+        """
+        增量分析：从 start 处开始切分单词，直到与上次的单词流重新对齐
+        :param start: 开始位置，必须是上次切分时某个单词的结束位置
+        :param resync: resync(pos) 在每个单词开始前调用，返回真时停止
+        :return: 新切分的单词流
+        """
+        self.__start = self.__synced = start
+        self.line_num = self.text.count("\n", 0, start) + 1
+        self.__scan(resync=resync)
+        self.tokens.end_line = self.line_num
+        return self.tokens
+
+    def __scan(self, final=True, resync=None):
+        """
+        切分缓冲区中的单词
+        :param final: 缓冲区之后是否没有更多字符，为假时缓冲区末尾未读完的单词留到下一块
+        :param resync: 增量分析时在每个单词开始前调用，返回真时停止
+        :return: 是否读到文件结束符
+        """
+        self.__final = final
+        classes = self.__classes
+        readers = self.__readers
+        end = len(classes)
+        pos = self.__start
+        if self.__comment is not None and pos < end:
+            pos = self.__resume_comment(pos)
+            if pos is None:  # 整块都在注释中
+                pos = end - 1
+                self.__sync(pos)
+                self.__start = pos
+                return False
+        while pos < end:
+            cls = classes[pos]
+            if cls <= C_NEWLINE:
+                # 读到空格、制表符、换行符，读取下一个字符
+                pos += 1
+                continue
+            if cls == C_END:
+                # 读到文件结束符
+                self.__sync(pos + 1)
+                return True
+            if resync is not None and resync(pos):
+                break
             try:
-                if (temp_char == " ") or (temp_char == "\t") or (temp_char == "\n"):
-                    # 读到空格、制表符，重读字符
-                    temp_char = self.__read_char()
-                elif re.match(LETTER_RE, temp_char):
-                    # 读到字母，调用标识符读取函数
-                    temp_char = self.__read_identifier(temp_char)
-                elif re.match(SINGLE_RE, temp_char) or re.match(
-                    DOUBLE_ST_RE, temp_char
-                ):
-                    # 单分界符或双分界符字首
-                    temp_char = self.__read_boundary(temp_char)
-                elif re.match(DIGIT_RE, temp_char):
-                    # 读到数字，调用数字读取函数
-                    temp_char = self.__read_digit(temp_char)
-                elif temp_char == "/":
-                    # 读到/，进行注释与'/'处理
-                    temp_char = self.__read_comment(temp_char)
-                elif temp_char == '\0':
-                    # 读到文件结束符
-                    break
-                else:
-                    raise LexicalError(
-                        self.line_num,
-                        "非法字符：[{0}]，code：[{1}]".format(
-                            temp_char, ord(temp_char)
-                        ),
-                    )
+                nxt = readers[cls](pos)  # 读取单词，返回下一个待读取的位置
             except LexicalError as e:
                 e.print()  # 错误输出
-                if self.midi_reader.has_msg():
-                    temp_char = self.__read_char()  # 发生错误时，继续读取下一个字符，如果需要发生错误时停止，将try-catch放到循环外
-                else:
-                    break
-        return self.out_filename  # 返回单词流文件名
+                self.error_count += 1
+                pos = self.__pos + 1  # 发生错误时，跳过出错的字符继续读取，如果需要发生错误时停止，将try-catch放到循环外
+                continue
+            if nxt is None:  # 单词可能延续到下一块
+                if self.__comment is not None:
+                    pos = end - 1  # 注释中已检查的内容不再保留，只保留最后一个字符
+                break
+            pos = nxt
+        self.__sync(pos)
+        self.__start = pos
+        return False
+
+    def __read_illegal(self, pos):
+        """
+        非法字符处理
+        :param pos: 当前字符位置
+        """
+        self.__error(pos, "非法字符：[{0}]，code：[{1}]".format(self.text[pos], ord(self.text[pos])))
 
-    def __read_comment(self, last_char):
+    def __read_comment(self, pos):
         """
         注释处理、/字符处理
-        :param last_char: 当前字符
-        :return: 最后读取的字符
-        """
-        temp_str = last_char
-        last_char = self.__read_char()
-        if last_char == "*":
-            back_char = self.__read_char()
-            last_char = self.__read_char()
-            temp_str = "/*" + back_char
-            # 循环到*/结束
-            while not ((back_char == "*") and (last_char == "/")):
-                temp_str += last_char  # 拼接注释部分
-                back_char = last_char  # 备份字符
-                last_char = self.__read_char()  # 读取字符
-            temp_str += last_char  # 拼接最后的/
-            if temp_str.count("/*") + temp_str.count("*/") > 2:
-                raise LexicalError(self.line_num, "注释不允许嵌套")
-            last_char = self.__read_char()
-            # self.__print_info('comment', temp_str)  # 输出注释，解开本行注释可以输出注释内容
-        else:
-            self.__print_info(temp_str, temp_str)  # 单独/的处理
-        return last_char
-
-    def __read_boundary(self, last_char):
-        """
-        私有方法，读取分界符
-        :param last_char: 当前字符
-        :return: 最后读取的字符
-        """
-        temp_str = last_char
-        stop = False
-        if re.match(DOUBLE_ST_RE, last_char):
-            if re.match(SINGLE_RE, last_char):
-                # <>!=开头的分界符
-                last_char = self.__read_char()
-                if last_char == "=":
-                    temp_str += last_char
-                else:
-                    stop = True
-            else:
-                # &|开头的分界符
-                last_char = self.__read_char()
-                if last_char is not temp_str:  # 后一个字符与当前字符不同
-                    raise LexicalError(
-                        self.line_num,
-                        "非法的分界符：{0}{1}".format(temp_str, last_char),
-                    )
-                else:
-                    # 识别为&&或||
-                    temp_str += last_char
-        # elif re.match(SINGLE_RE, last_char):  # 余下的单分界符，+-*(){};,.这里没有/
-        #     if last_char is '{':
-        #         self.__new_scope()  # 读取到'{'，创建新的作用域
-        #     elif last_char is '}':
-        #         previous = self.now_scope.previous
-        #         if previous is None:  # 已经回退到顶级作用域
-        #             raise CompileError(self.line_num, "不匹配的}")
-        #         self.now_scope = previous  # 读取到'}'，返回上移作用域
-        self.__print_info(temp_str, temp_str)
-        if not stop:
-            last_char = self.__read_char()
-        return last_char
-
-    def __read_digit(self, last_char):
+        :param pos: 当前字符位置
+        :return: 下一个待读取的位置
+        """
+        text = self.text
+        nxt = pos + 1
+        end = len(text)
+        if nxt >= end and not self.__final:
+            return None
+        if text[nxt:nxt + 1] != "*":
+            self.__sync(nxt + 1)
+            self.__print_info("/", "/", pos)  # 单独/的处理
+            return nxt
+        if pos + 3 > end and not self.__final:
+            return None  # 还不能判断是否为 /*/
+        # 注释开始的*不能作为结束的*，/*/ 按嵌套处理
+        return self.__read_comment_body(pos + 2, text[pos + 2:pos + 3] == "/")
+
+    def __read_comment_body(self, pos, nested):
+        """
+        一次查找定位注释结束的*/，开始的/*与结束的*/之间不能再出现/*
+        流式分析时注释没有在缓冲区内结束，记录是否出现过/*，之后的块从缓冲区的最后一个字符继续查找
+        :param pos: 注释内容中待查找的位置
+        :param nested: 之前的注释内容中是否出现了/*
+        :return: 下一个待读取的位置，注释延续到下一块时返回 None
+        """
+        text = self.text
+        close = text.find("*/", pos)
+        if close < 0:
+            if not self.__final:
+                self.__comment = nested or text.find("/*", pos) >= 0
+                return None
+            self.__error(len(text), "注释没有结束")
+        last = close + 1
+        # 在缓冲区内查找，不拼接注释内容
+        if nested or text.find("/*", pos, last + 1) >= 0:
+            self.__error(last, "注释不允许嵌套")
+        # self.__print_info('comment', text[pos:last + 1], pos)  # 输出注释，解开本行注释可以输出注释内容
+        return last + 1
+
+    def __resume_comment(self, pos):
+        """
+        继续查找上一块延续的注释
+        :param pos: 上一块保留的最后一个字符的位置
+        :return: 下一个待读取的位置，注释延续到下一块时返回 None
+        """
+        nested = self.__comment
+        self.__comment = None
+        try:
+            return self.__read_comment_body(pos, nested)
+        except LexicalError as e:
+            e.print()
+            self.error_count += 1
+            return self.__pos + 1
+
+    def __read_single(self, pos):
+        """
+        私有方法，读取单分界符 +-*(){}:;,[]
+        :param pos: 当前字符位置
+        :return: 下一个待读取的位置
+        """
+        self.__sync(pos + 1)
+        char = self.text[pos]
+        self.__print_info(char, char, pos)
+        return pos + 1
+
+    def __read_compare(self, pos):
+        """
+        私有方法，读取<>!=开头的分界符
+        :param pos: 当前字符位置
+        :return: 下一个待读取的位置
+        """
+        nxt = pos + 1
+        if nxt >= len(self.text) and not self.__final:
+            return None
+        self.__sync(nxt + 1)
+        if self.text[nxt:nxt + 1] == "=":
+            temp_str = self.text[pos:nxt + 1]
+            self.__print_info(temp_str, temp_str, pos)
+            return nxt + 1
+        char = self.text[pos]
+        self.__print_info(char, char, pos)
+        return nxt
+
+    def __read_logic(self, pos):
+        """
+        私有方法，读取&|开头的分界符，只能识别为&&或||
+        :param pos: 当前字符位置
+        :return: 下一个待读取的位置
+        """
+        nxt = pos + 1
+        if nxt >= len(self.text) and not self.__final:
+            return None
+        temp_str = self.text[pos:nxt + 1]
+        if temp_str[1:] != temp_str[0]:  # 后一个字符与当前字符不同
+            self.__error(nxt, "非法的分界符：{0}".format(temp_str.replace("\n", " ")))
+        self.__sync(nxt + 1)
+        self.__print_info(temp_str, temp_str, pos)
+        return nxt + 1
+
+    def __read_digit(self, pos):
         """
         私有方法，读取数字
-        :param last_char: 上一个字符、开始字符
-        :return: 执行后，最后读取的字符
+        :param pos: 开始字符位置
+        :return: 数字后第一个字符的位置
         """
-        temp_num = ""
+        classes = self.__classes
+        end = len(classes)
+        last = pos + 1
         # 循环到文件结尾或中间返回
-        while last_char != "":
-            # 空格符、制表符、单分界符、双分界符
-            if (
-                last_char == " "
-                or last_char == "\t"
-                or re.match(SINGLE_RE, last_char)
-                or re.match(DOUBLE_ST_RE, last_char)
-            ):
+        while last < end:
+            cls = classes[last]
+            if cls == C_DIGIT:
+                last += 1
+            elif cls in NUMBER_END:
+                # 空白符、单分界符、双分界符
                 break
-            elif re.match(DIGIT_RE, last_char):
-                # 得到数字，进行拼接
-                temp_num += last_char
-                last_char = self.__read_char()
             else:
-                raise LexicalError(self.line_num, "非法字符：[{0}]".format(last_char))
-        self.__print_info("NUM", temp_num)
-        return last_char
+                self.__error(last, "非法字符：[{0}]".format(self.text[last]))
+        if last >= end and not self.__final:
+            return None
+        self.__sync(last + 1)
+        self.__print_info("NUM", self.text[pos:last], pos)
+        return last
 
-    def __read_identifier(self, last_char):
+    def __read_identifier(self, pos):
         """
         私有方法：分析标识符、保留字
-        :param last_char: 上一个字符、开始字符
-        :return: 最后读取的字符
+        :param pos: 开始字符位置
+        :return: 标识符后第一个字符的位置
         """
-        temp_str = ""
+        classes = self.__classes
+        end = len(classes)
+        last = pos + 1
         # 为字母和数字时，持续读取字符
-        while re.match(DIGIT_RE, last_char) or re.match(LETTER_RE, last_char):
-            temp_str += last_char  # 拼接标识符
-            last_char = self.__read_char()
+        while last < end and classes[last] in IDENTIFIER_PART:
+            last += 1
+        if last >= end and not self.__final:
+            return None
+        self.__sync(last + 1)
+        temp_str = self.text[pos:last]
         # 如果得到的标识符为保留字，flag为当前字符串。否则为ID
-        # flag = temp_str if re.match(self.keyword_re, temp_str) else 'ID'  # 正则表达式方法
-        flag = (
-            temp_str.lower()
-            if self.__is_keyword(temp_str.lower(), 0, len(self.__keyword) - 1)
-            else "ID"
-        )
-        self.__print_info(flag, temp_str)
-        return last_char  # 返回最后读取的字符
-
-    def __is_keyword(self, word, left, right):
-        """
-        二分法查找比对、判断当前单词是否为保留字
-        程序中注释掉的部分为正则表达式方式
-        :param word: 当前单词
-        :param left right: 二分标记
-        :return: 布尔值
-        """
-        mid = int((right + left) / 2)  # 二分索引值
-        if self.__keyword[mid] == word:  # 匹配，直接返回
-            return True
-        elif left == right:
-            return False
-        elif self.__keyword[mid] > word:  # 中间值大于当前值，递归左边
-            return self.__is_keyword(word, left, mid)
-        else:  # 递归右边
-            return self.__is_keyword(word, mid + 1, right)
-
-    def __print_info(self, i_type, value):
+        flag = temp_str.lower()
+        if flag not in KEYWORDS:
+            flag = "ID"
+        self.__print_info(flag, temp_str, pos)
+        return last
+
+    def __error(self, pos, error_msg):
+        """
+        在 pos 处的字符读取后报告错误，错误恢复时从下一个字符继续
+        """
+        self.__pos = pos
+        self.__sync(pos + 1)
+        raise LexicalError(self.line_num, error_msg)
+
+    def __sync(self, end):
+        """
+        统计 end 之前尚未统计的换行符，增加行号
+        :param end: 已读取字符的结束位置（不包含）
+        """
+        start = self.__synced
+        if end > start:
+            self.line_num += self.text.count("\n", start, end)
+            self.__synced = end
+
+    def __print_info(self, i_type, value, start):
         # if i_type == 'ID':
         #     scope = self.now_scope.get_scope_str(value)
         #     if scope is None:  # 作用域为None，说明没有声明
@@ -241,24 +419,16 @@ class LexicalAnalyse:
         #     print('\033[0;34;0m{type:15}{val:15}Scope：{scope}\033[0m'.format(type=i_type, val=value, scope=scope))
         # else:
         # print('\033[0;34;0m{type:15}{val}\033[0m'.format(type=i_type, val=value))
-        self.out_file.write("{0:15} {1}\n".format(i_type, value))  # 单词输出到文件
+        self.__emit(i_type, value, self.line_num, start)  # 单词加入单词流
 
-    def close(self):
+    def __append_pending(self, i_type, value, line_num, start):
         """
-        关闭文件流，词法分析结束后调用
+        流式分析时，单词暂存到当前块的单词列表
         """
-        self.out_file.close()
+        self.__pending.append((TYPE_IDS[i_type], sys.intern(value), line_num))
 
-    def __read_char(self):
-        try:
-            # 将读取到的一个字节数据直接转为字符
-            temp_char = chr(next(self.midi_reader))
-            if temp_char == "\n":
-                self.out_file.write(
-                    "{0}\n".format("[enter]")
-                )  # 单词输出到文件，输出单词与行号
-                self.line_num += 1
-                temp_char = " "  # 行号加1，转为空格
-            return temp_char
-        except StopIteration:
-            return ""
+    def close(self):
+        """
+        关闭 MIDI 文件，词法分析结束后调用
+        """
+        self.midi_reader.close()
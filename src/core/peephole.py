@@ -0,0 +1,215 @@
+# 窥孔优化：链接前在指令序列上做局部改写，减少虚拟机执行的指令数
+from .ir import JUMP_OPS, Op, Program
+
+__author__ = "mori"
+
+RULES = ("labels", "jumps", "dead_code", "reload")  # 可选的改写规则，默认全部启用
+MAX_ROUNDS = 10  # 规则之间会产生新的改写机会，重复执行直到没有变化
+
+END_OPS = frozenset((Op.BR, Op.RET, Op.STOP))  # 之后的指令只能经标号到达
+LOAD_OF = {Op.STO: Op.LOAD, Op.STO_LOCAL: Op.LOAD_LOCAL}  # 写入指令 -> 读取同一地址的指令
+INT_RESULT_OPS = frozenset((  # 压栈的值一定是整数的指令，LOAD 取出时转为整数，除法的结果可能是浮点数
+    Op.LOAD, Op.LOAD_LOCAL, Op.IN,
+    Op.EQ, Op.NOTEQ, Op.GT, Op.LES, Op.GE, Op.LE, Op.AND, Op.OR, Op.NOT,
+))
+
+
+class Peephole:
+    """
+    窥孔优化类，指令按 (操作码, 操作数, 行号) 处理，标号以编号引用
+    labels：合并相邻的标号，删除没有引用的标号
+    jumps：转移到 BR 的转移直接转移到最终目标，删除转移到下一条指令的 BR
+    dead_code：删除 BR、RET、STOP 之后到下一个标号之前不可达的指令
+    reload：写入后出栈又立即读回同一个值时（STO x; POP; LOAD x 与连续的 LOADI c; STO; POP），保留栈顶的值
+    """
+
+    def __init__(self, rules=RULES):
+        """
+        :param rules: 启用的规则名称
+        """
+        for rule in rules:
+            if rule not in RULES:
+                raise ValueError("未知的窥孔优化规则：{}".format(rule))
+        self.rules = tuple(rule for rule in RULES if rule in rules)  # 按固定顺序执行
+        self.stats = {}  # 统计：优化前后的指令数、标号数与每条规则的改写次数
+
+    def optimize(self, program):
+        """
+        :param program: 语义分析生成的未链接程序
+        :return: 优化后的程序
+        """
+        if program.linked:
+            raise ValueError("窥孔优化需要在链接前进行")
+        code = list(zip(program.ops, program.args, program.lines))
+        functions = dict(program.functions)
+        stats = self.stats = dict.fromkeys(self.rules, 0)
+        stats["before"], stats["labels_before"] = count_code(code)
+        for _ in range(MAX_ROUNDS):
+            changed = 0
+            for rule in self.rules:
+                if rule == "labels":
+                    code, functions, count = merge_labels(code, functions)
+                elif rule == "jumps":
+                    code, count = thread_jumps(code)
+                elif rule == "dead_code":
+                    code, count = remove_dead_code(code)
+                else:
+                    code, count = remove_reloads(code)
+                stats[rule] += count
+                changed += count
+            if not changed:
+                break
+        stats["after"], stats["labels_after"] = count_code(code)
+        result = Program()
+        for op, arg, line_num in code:
+            result.emit(op, arg, line_num)
+        result.functions = functions
+        return result
+
+    def report(self):
+        """
+        :return: 优化统计的文本
+        """
+        stats = self.stats
+        rules = "，".join("{0} {1}".format(rule, stats[rule]) for rule in self.rules)
+        return "窥孔优化：指令 {0} -> {1}，标号 {2} -> {3}（{4}）".format(
+            stats["before"], stats["after"], stats["labels_before"], stats["labels_after"], rules
+        )
+
+
+def count_code(code):
+    """
+    :return: (指令数, 标号数)，标号伪指令不计入指令数
+    """
+    labels = sum(1 for op, _, _ in code if op == Op.LABEL)
+    return len(code) - labels, labels
+
+
+def merge_labels(code, functions):
+    """
+    相邻的标号合并为第一个，删除没有被转移或函数表引用的标号
+    :return: (指令序列, 函数表, 删除的标号数)
+    """
+    alias = {}  # 被合并的标号 -> 保留的标号
+    first = None
+    for op, arg, _ in code:
+        if op == Op.LABEL:
+            if first is None:
+                first = arg
+            else:
+                alias[arg] = first
+        else:
+            first = None
+    functions = {name: (alias.get(entry, entry), par_num) for name, (entry, par_num) in functions.items()}
+    used = {entry for entry, _ in functions.values()}
+    used.update(alias.get(arg, arg) for op, arg, _ in code if op in JUMP_OPS)
+    result = []
+    for op, arg, line_num in code:
+        if op == Op.LABEL:
+            if arg in alias or arg not in used:
+                continue
+        elif op in JUMP_OPS:
+            arg = alias.get(arg, arg)
+        result.append((op, arg, line_num))
+    return result, functions, len(code) - len(result)
+
+
+def thread_jumps(code):
+    """
+    BR、BRF 的目标是 BR 时直接转移到最终目标；BR 的目标就是下一条指令时删除
+    :return: (指令序列, 改写次数)
+    """
+    targets = {}  # 标号 -> 标号之后第一条指令的序号
+    next_index = [0] * len(code)  # 每个位置之后（跳过标号）第一条指令的序号
+    following = len(code)
+    for index in range(len(code) - 1, -1, -1):
+        next_index[index] = following
+        op, arg, _ = code[index]
+        if op == Op.LABEL:
+            targets[arg] = following
+        else:
+            following = index
+    count = 0
+    result = []
+    for index, (op, arg, line_num) in enumerate(code):
+        if op == Op.BR or op == Op.BRF:
+            label = arg
+            seen = {label}
+            while True:  # 沿转移链找到最终目标，遇到环时停止
+                target = targets.get(label)
+                if target is None or target >= len(code) or code[target][0] != Op.BR:
+                    break
+                label = code[target][1]
+                if label in seen:
+                    break
+                seen.add(label)
+            if label != arg:
+                arg = label
+                count += 1
+            if op == Op.BR and label is not None and targets.get(label) == next_index[index]:
+                count += 1  # 转移到下一条指令
+                continue
+        result.append((op, arg, line_num))
+    return result, count
+
+
+def remove_dead_code(code):
+    """
+    删除 BR、RET、STOP 之后、下一个标号之前的指令
+    :return: (指令序列, 删除的指令数)
+    """
+    result = []
+    dead = False
+    for instruction in code:
+        op = instruction[0]
+        if op == Op.LABEL:
+            dead = False
+        elif dead:
+            continue
+        result.append(instruction)
+        if op in END_OPS:
+            dead = True
+    return result, len(code) - len(result)
+
+
+def remove_reloads(code):
+    """
+    栈顶的值写入若干地址后出栈，下一条指令又把同一个值压栈时，删除出栈与压栈
+    STO x; POP; LOAD x 只在写入的值一定是整数时改写（LOAD 会把浮点数转为整数）
+    LOADI c; STO x; POP; LOADI c 改写为 LOADI c; STO x
+    :return: (指令序列, 改写次数)
+    """
+    result = []
+    known = None  # 栈顶的常量，(类型, 值)
+    is_int = False  # 栈顶的值是否一定是整数
+    stored = set()  # 栈顶的值已写入的地址，(读取指令, 地址)
+    count = 0
+    index = 0
+    while index < len(code):
+        op, arg, line_num = code[index]
+        if op == Op.POP and index + 1 < len(code):
+            next_op, next_arg, _ = code[index + 1]
+            if (
+                next_op == Op.LOADI and known == (type(next_arg), next_arg)
+                or is_int and (next_op, next_arg) in stored
+            ):
+                index += 2  # 栈顶的值保持不变，状态不变
+                count += 1
+                continue
+        result.append((op, arg, line_num))
+        index += 1
+        if op == Op.LOADI:
+            known = (type(arg), arg)
+            is_int = isinstance(arg, int)
+            stored = set()
+        elif op in LOAD_OF:
+            stored.add((LOAD_OF[op], arg))
+        elif op in INT_RESULT_OPS:
+            known = None
+            is_int = True
+            stored = set()
+        else:
+            known = None
+            is_int = False
+            stored = set()
+    return result, count
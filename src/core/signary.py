@@ -1,73 +1,103 @@
-# 符号表，栈式符号表管理
+# 符号表，平铺的绑定栈管理作用域，语法分析时完成名字解析
 __author__ = 'mori'
 
+FRAME_START = 1  # 函数栈帧的起始地址，地址0保存返回值
 
-class Scope:
+
+class Symbol:
     """
-    作用域类，符号表操作
+    符号类，标识符的一次声明，语法分析时绑定到标识符节点，语义分析直接使用
     """
 
-    def __init__(self, previous, scope_id, offset=False, start_add=0):
-        self.previous = previous  # 上一层作用域
-        self.scope_id = scope_id  # 作用域编号，仅用于识别
-        self.table = {}  # 标识符表
-        self.now_index = start_add  # 符号表内部命令栈标记
-        self.offset = offset
+    __slots__ = ("name", "kind", "size", "address", "local", "depth")
+
+    def __init__(self, name, kind="int", size=0):
+        self.name = name  # 标识符名
+        self.kind = kind  # 类型：int、array、function
+        self.size = size  # 数组长度
+        self.address = None  # 变量地址或数组首地址，函数为None
+        self.local = False  # 地址是否相对于函数栈帧
+        self.depth = 0  # 声明所在作用域的层数
+
+    def __str__(self):
+        return self.name  # 输出语法树时显示标识符名
 
-    def get_by_id(self, id_name):
+
+class SymbolTable:
+    """
+    符号表类，每个名字对应一个绑定栈，栈顶为最内层的声明，查找不需要沿作用域链逐层查表
+    """
+
+    def __init__(self):
+        self.bindings = {}  # 标识符名 -> 绑定栈
+        self.__scopes = [[]]  # 每层作用域中声明的符号，第0层为全局作用域
+        self.__frames = [[0, False]]  # 栈帧：[下一个可用地址, 是否为函数栈帧]，第0个为全局数据区
+        self.__frame_depths = []  # 函数栈帧所在作用域的层数
+
+    @property
+    def depth(self):
         """
-        查表，会持续向上级作用域查找，直到找到
-        :param id_name: id
-        :return: 地址，没有值返回None
+        :return: 当前作用域的层数，全局作用域为0
         """
-        now_scope = self
-        while now_scope:
-            temp_val = now_scope.table.get(id_name)
-            if temp_val:
-                return temp_val
-            else:
-                now_scope = now_scope.previous
-        return None
+        return len(self.__scopes) - 1
 
-    def get_scope_str(self, id_name):
+    def enter(self, frame=False):
         """
-        :return: 返回当前标识符所在作用域的字符串表示 TODO 弃用这个
+        进入新的作用域
+        :param frame: 是否同时进入新的函数栈帧，函数栈帧中的变量使用相对地址
         """
-        scope_str = None
-        now_scope = self
-        while now_scope:
-            temp_val = now_scope.table.get(id_name)
-            if temp_val is not None:
-                scope_str = now_scope.scope_id.__str__()
-                now_scope = now_scope.previous
-                break
-            else:
-                now_scope = now_scope.previous
-        if scope_str:
-            while now_scope:
-                scope_str = now_scope.scope_id.__str__() + '-' + scope_str
-                now_scope = now_scope.previous
-        return scope_str
+        self.__scopes.append([])
+        if frame:
+            self.__frames.append([FRAME_START, True])
+            self.__frame_depths.append(self.depth)
 
-    def put(self, key, value, size=0, address=''):
+    def exit(self):
         """
-        插入符号表
-        :param key: 变量名
-        :param value: 变量类型
-        :param size: 数组长度，参数列表长度
-        :param address: 指令起始位置
-        :return 是否冲突
+        退出当前作用域，弹出其中声明的绑定
         """
-        use_address = ":{}".format(self.now_index)
-        if self.table.get(key):
-            return True  # 同一作用域重复插入
-        if value == 'function':
-            self.table[key] = (address, value, size)
-            return False
-        if size:
-            self.table[key] = (use_address if self.offset else use_address[1:], value, size)  # 为数组分配地址
-            self.now_index += (size - 1)  # 地址索引后移指定长度
+        if self.__frame_depths and self.__frame_depths[-1] == self.depth:
+            self.__frame_depths.pop()
+            self.__frames.pop()
+        bindings = self.bindings
+        for symbol in self.__scopes.pop():
+            stack = bindings[symbol.name]
+            stack.pop()
+            if not stack:
+                del bindings[symbol.name]
+
+    def declare(self, symbol):
+        """
+        在当前作用域中声明符号，变量按声明顺序分配地址
+        :param symbol: 符号
+        :return: 是否与当前作用域中的声明冲突
+        """
+        stack = self.bindings.get(symbol.name)
+        if stack and stack[-1].depth == self.depth:
+            return True  # 同一作用域重复声明
+        symbol.depth = self.depth
+        if symbol.kind != "function":
+            frame = self.__frames[-1]
+            symbol.address = frame[0]
+            symbol.local = frame[1]
+            frame[0] += symbol.size or 1  # 数组占用 size 个地址
+        if stack is None:
+            self.bindings[symbol.name] = [symbol]
         else:
-            self.table[key] = (use_address if self.offset else use_address[1:], value)  # 为变量分配地址、保存变量的类型，元组表示
-        self.now_index += 1  # 地址+1
+            stack.append(symbol)
+        self.__scopes[-1].append(symbol)
         return False
+
+    def lookup(self, name):
+        """
+        查找最内层的声明
+        :param name: 标识符名
+        :return: 符号，没有声明时返回None
+        """
+        stack = self.bindings.get(name)
+        return stack[-1] if stack else None
+
+    def global_symbols(self):
+        """
+        :return: 全局作用域中已声明的符号
+        """
+        return list(self.__scopes[0])
@@ -0,0 +1,191 @@
+# 单词流：词法分析结果在内存中的紧凑表示，由语法分析直接读取
+import pickle
+import sys
+from array import array
+from itertools import islice
+
+__author__ = "mori"
+
+# 单词类别，按编号保存，语法分析时再映射回名称
+TYPE_NAMES = (
+    "ID",
+    "NUM",
+    # 保留字
+    "if",
+    "else",
+    "for",
+    "while",
+    "do",
+    "int",
+    "write",
+    "read",
+    "switch",
+    "case",
+    "default",
+    "call",
+    "function",
+    "main",
+    "return",
+    "break",
+    "continue",
+    # 分界符
+    "+",
+    "-",
+    "*",
+    "/",
+    "=",
+    "(",
+    ")",
+    "{",
+    "}",
+    ":",
+    ";",
+    ",",
+    "[",
+    "]",
+    "<",
+    ">",
+    "!",
+    "<=",
+    ">=",
+    "!=",
+    "==",
+    "&&",
+    "||",
+)
+TYPE_IDS = {name: type_id for type_id, name in enumerate(TYPE_NAMES)}  # 类别名称 -> 编号
+
+DUMP_FILE = "out/lexical.o"
+
+
+class TokenStream:
+    """
+    单词流，单词类别编号、单词值、行号分别保存在并列的序列中
+    """
+
+    def __init__(self):
+        self.types = array("B")  # 单词类别编号
+        self.values = []  # 单词值，驻留的字符串
+        self.lines = array("I")  # 单词所在行号
+        self.starts = array("I")  # 单词在源代码文本中的开始位置
+        self.end_line = 1  # 读完全部字符后的行号
+
+    def append(self, word_type, value, line_num, start=0):
+        """
+        追加单词
+        :param word_type: 单词类别名称
+        :param value: 单词值
+        :param line_num: 行号
+        :param start: 开始位置
+        """
+        self.types.append(TYPE_IDS[word_type])
+        self.values.append(sys.intern(value))
+        self.lines.append(line_num)
+        self.starts.append(start)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        return self.iter_from()
+
+    def iter_from(self, index=0):
+        """
+        :param index: 开始的单词序号
+        :return: 生成器，产出 (单词类别编号, 单词值, 行号)，结束时返回最后的行号
+        """
+        yield from zip(
+            islice(self.types, index, None),
+            islice(self.values, index, None),
+            islice(self.lines, index, None),
+        )
+        return self.end_line
+
+    def stop(self, index):
+        """
+        :return: 第 index 个单词的结束位置
+        """
+        return self.starts[index] + len(self.values[index])
+
+    def type_name(self, index):
+        """
+        :return: 第 index 个单词的类别名称
+        """
+        return TYPE_NAMES[self.types[index]]
+
+    def dumps(self):
+        """
+        序列化单词流，用于编译缓存
+        :return: bytes
+        """
+        return pickle.dumps(
+            (bytes(self.types), self.values, self.lines.tobytes(), self.starts.tobytes(), self.end_line),
+            pickle.HIGHEST_PROTOCOL,
+        )
+
+    @staticmethod
+    def loads(data):
+        """
+        由 dumps 的结果还原单词流
+        :param data: bytes
+        :return: 单词流
+        """
+        res = TokenStream()
+        try:
+            types, values, lines, starts, res.end_line = pickle.loads(data)
+            res.types.frombytes(types)
+            res.values = list(map(sys.intern, values))
+            res.lines.frombytes(lines)
+            res.starts.frombytes(starts)
+        except (pickle.UnpicklingError, EOFError, TypeError, ValueError, AttributeError, ImportError) as e:
+            raise ValueError("单词流数据不完整") from e
+        if not len(res.types) == len(res.values) == len(res.lines) == len(res.starts):
+            raise ValueError("单词流数据不完整")
+        return res
+
+    def dump(self, file_out=DUMP_FILE):
+        """
+        按文本格式输出单词流，每个单词一行，换行符输出为 [enter]
+        :param file_out: 输出文件名
+        :return: 输出文件名
+        """
+        with open(file_out, "w+", encoding="utf-8") as out_file:
+            line_num = 1
+            for type_id, value, word_line in zip(self.types, self.values, self.lines):
+                if word_line > line_num:
+                    out_file.write("[enter]\n" * (word_line - line_num))
+                    line_num = word_line
+                out_file.write("{0:15} {1}\n".format(TYPE_NAMES[type_id], value))
+            if self.end_line > line_num:
+                out_file.write("[enter]\n" * (self.end_line - line_num))
+        return file_out
+
+
+class TokenCursor:
+    """
+    单词游标，从单词生成器按需读取，读过的单词不保留
+    生成器产出 (单词类别编号, 单词值, 行号)，结束时返回最后的行号
+    """
+
+    def __init__(self, tokens):
+        """
+        :param tokens: TokenStream 或单词生成器
+        """
+        self.__tokens = iter(tokens)
+        self.position = 0  # 已读取的单词数，即下一个单词的序号
+        self.end_line = None  # 单词读完后的行号，读完前为 None
+
+    def read(self):
+        """
+        读取下一个单词
+        :return: 单词，没有更多单词时返回 None
+        """
+        if self.end_line is not None:
+            return None
+        try:
+            token = next(self.__tokens)
+        except StopIteration as e:
+            self.end_line = e.value
+            return None
+        self.position += 1
+        return token
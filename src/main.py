@@ -1,43 +1,152 @@
 # 主控程序
+import argparse
 import os
 import sys
-from .core.compile_error import TestRuntimeError
 
 __author__ = 'mori'
 
 from .core import lexical, compile_error as CE
-from .core import grammar, semantic, machine
+from .core import grammar, semantic, bytecode
+from .core.fold import fold_tree
+from .core.incremental import IncrementalFrontend
+from .core.token import TokenStream
+from .core.peephole import Peephole, RULES
+from .cache import CompileCache, DEFAULT_DIR, DEFAULT_SIZE, TOKENS, PROGRAM
+from .run import run
 
 
-def main(midi_path: str):
-    lexical_exe = lexical.LexicalAnalyse(midi_path)  # 打开文件
-    lexical_file = lexical_exe.analyse()  # 进行词法分析，得到单词流文件
-    lexical_exe.close()  # 关闭文件
+def main(midi_path: str, cache: CompileCache = None, dump=False, stream=False, incremental=False,
+         output=None, lines=True, rules=RULES, stats=False, fold=True):
+    """
+    编译并执行
+    :param cache: 编译缓存，None 表示不使用缓存；dump、stats、incremental 需要完整编译，不使用缓存的程序
+    :param dump: 是否输出单词流文件 out/lexical.o 与指令清单 out/semantic.o
+    :param stream: 是否流式编译：逐块解码并切分单词，语法分析按需读取，错误在读到时立即报告
+    :param incremental: 是否增量编译：与上次编译的源代码比较，只重新分析修改过的部分
+    :param output: 字节码文件名，不为 None 时只编译并保存字节码，不执行
+    :param lines: 字节码文件是否包含行号表
+    :param rules: 启用的窥孔优化规则，为空时不优化
+    :param stats: 是否输出常量折叠的表达式数与窥孔优化前后的指令数
+    :param fold: 是否在语义分析前折叠常量表达式
+    """
+    key = source_key = None
+    if cache is not None:
+        source_key = cache.key_of(midi_path)  # 单词流只取决于源代码
+        key = cache.key_of(midi_path, '{0};fold={1}'.format(','.join(rules), fold))  # 优化选项不同时编译结果不同
+        program_file = None if dump or stats or incremental else cache.get(key, PROGRAM)
+        if program_file is not None:  # 命中缓存，直接执行或保存
+            program = bytecode.load(program_file)
+            if output is not None:
+                bytecode.save(program, output, lines)
+            else:
+                run(program)
+            return
+
+    frontend = None
+    tokens = lexical_exe = None
+    if cache is not None and not incremental:
+        tokens = load_tokens(cache, source_key)  # 源代码未变化时不重新解码与词法分析
+    if tokens is not None:
+        stream = False  # 单词流已完整读入内存
+    elif incremental:
+        frontend = IncrementalFrontend()
+        tokens = frontend.lex(midi_path)  # 与上次编译的结果比较，只重新切分修改过的部分
+        lexical_exe = frontend.lexer
+    else:
+        lexical_exe = lexical.LexicalAnalyse(midi_path, stream)  # 打开文件
+        if stream:
+            tokens = lexical_exe.iter_tokens()  # 单词生成器，语法分析读取时才进行词法分析
+        else:
+            tokens = lexical_exe.analyse()  # 进行词法分析，得到单词流
+            lexical_exe.close()  # 关闭文件
+    if dump:
+        tokens.dump()  # 输出单词流文件
 
     try:
         # 语法分析：要求整理出识别的错误
-        grammar_exe = grammar.GrammarAnalyse(lexical_file)  # 打开词法分析结果文件
-        grammar_exe.program()  # 开始语法分析
-        grammar_exe.close()  # 关闭文件
-        grammar_exe.tree.print_tree()  # 打印语法树
+        if frontend is not None:
+            tree = frontend.parse()  # 只重新分析修改过的函数
+        else:
+            grammar_exe = grammar.GrammarAnalyse(tokens)  # 读取词法分析得到的单词流
+            grammar_exe.program()  # 开始语法分析
+            tree = grammar_exe.tree
+        tree.print_tree()  # 打印语法树
+        if fold:
+            count = fold_tree(tree)  # 常量折叠与代数化简
+            if stats:
+                print('常量折叠：{} 个表达式'.format(count))
 
         # 语义分析与中间代码生成
-        semantic_exe = semantic.Semantic(grammar_exe.tree)  # 初始化语义分析程序
-        semantic_file = semantic_exe.program()  # 开始语法分析
-        semantic_exe.close()  # 关闭相关文件
-
-        # 执行中间代码
-        machine_exe = machine.Machine(semantic_file)  # 初始化虚拟机
-        machine_exe.execute()  # 执行
+        semantic_exe = semantic.Semantic(tree)  # 初始化语义分析程序
+        program = semantic_exe.program()  # 开始语义分析，生成指令序列
+        if rules:
+            optimizer = Peephole(rules)
+            program = optimizer.optimize(program)  # 窥孔优化
+            if stats:
+                print(optimizer.report())
+        if dump:
+            program.dump()  # 输出指令清单，保留标号
+        program = program.link()  # 链接，删除标号
     except CE.CompileError as e:
         e.print()
-    except TestRuntimeError as e:
-        e.print()
+        return
+    finally:
+        if stream:
+            lexical_exe.close()
+
+    if cache is not None and (lexical_exe is None or lexical_exe.error_count == 0):  # 只缓存没有错误的编译结果
+        if lexical_exe is not None and not stream:  # 流式编译不保留完整的单词流
+            cache.put(source_key, {TOKENS: tokens.dumps()})
+        cache.put(key, {PROGRAM: bytecode.dumps(program)})
+    if output is not None:
+        bytecode.save(program, output, lines)  # 只编译，由 python -m src.run 执行
+        return
+    run(program)
+
+
+def load_tokens(cache, key):
+    """
+    读取缓存的单词流
+    :return: 单词流，未命中或缓存文件损坏时返回 None
+    """
+    tokens_file = cache.get(key, TOKENS)
+    if tokens_file is None:
+        return None
+    with open(tokens_file, 'rb') as file:
+        data = file.read()
+    try:
+        return TokenStream.loads(data)
+    except ValueError:
+        cache.invalidate(key)
+        return None
 
 
 if __name__ == '__main__':
-    # 从命令行参数中获取MIDI文件路径
-    midi_path = sys.argv[1]
+    parser = argparse.ArgumentParser(prog='python -m src.main', description='编译并运行 MIDI 源码')
+    parser.add_argument('midi_path', help='MIDI 文件路径')
+    parser.add_argument('--no-cache', action='store_true', help='不使用编译缓存')
+    parser.add_argument('--clear-cache', action='store_true', help='运行前清空编译缓存')
+    parser.add_argument('--cache-dir', default=DEFAULT_DIR, help='缓存目录，默认 %(default)s')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_SIZE // (1024 * 1024),
+                        help='缓存上限（MB），默认 %(default)s')
+    parser.add_argument('--dump', action='store_true', help='输出单词流文件 out/lexical.o 与指令清单 out/semantic.o')
+    parser.add_argument('--stream', action='store_true', help='流式编译，内存占用与程序长度无关，错误在读到时立即报告')
+    parser.add_argument('--incremental', action='store_true', help='增量编译，只重新分析与上次编译相比修改过的部分')
+    parser.add_argument('-o', '--output', help='只编译，保存字节码文件（.mbc），由 python -m src.run 执行')
+    parser.add_argument('--no-lines', action='store_true', help='字节码文件不包含行号表')
+    parser.add_argument('--peephole', default=','.join(RULES),
+                        help='启用的窥孔优化规则，逗号分隔，默认全部：%(default)s')
+    parser.add_argument('--no-opt', action='store_true', help='不进行窥孔优化')
+    parser.add_argument('--no-fold', action='store_true', help='不进行常量折叠')
+    parser.add_argument('--stats', action='store_true', help='输出常量折叠的表达式数与窥孔优化前后的指令数')
+    args = parser.parse_args()
+    if args.stream and (args.dump or args.incremental):
+        parser.error('--stream 不能与 --dump、--incremental 同时使用')
+    peephole_rules = () if args.no_opt else tuple(rule for rule in args.peephole.split(',') if rule)
+    for peephole_rule in peephole_rules:
+        if peephole_rule not in RULES:
+            parser.error('未知的窥孔优化规则：{0}，可选：{1}'.format(peephole_rule, ','.join(RULES)))
+    midi_path = args.midi_path
     # 检查文件是否存在
     if not os.path.isfile(midi_path):
         print(f"错误：文件 '{midi_path}' 不存在")
@@ -46,5 +155,11 @@ if __name__ == '__main__':
     if not midi_path.endswith('.mid'):
         print(f"错误：文件 '{midi_path}' 不是MIDI文件")
         sys.exit(1)
+    compile_cache = None
+    if not args.no_cache:
+        compile_cache = CompileCache(args.cache_dir, args.cache_size * 1024 * 1024)
+        if args.clear_cache:
+            compile_cache.clear()
     # 执行主函数
-    main(midi_path)
+    main(midi_path, compile_cache, args.dump, args.stream, args.incremental, args.output, not args.no_lines,
+         peephole_rules, args.stats, not args.no_fold)
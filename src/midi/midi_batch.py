@@ -0,0 +1,84 @@
+# 批量将代码转为 midi 文件，使用进程池并行转换
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .midi_writer import MidiWriter
+
+__author__ = "mori"
+
+SOURCE_SUFFIX = ".mc"
+MIDI_SUFFIX = ".mid"
+
+
+def collect_sources(paths, out_dir=None):
+    """
+    收集要转换的源文件
+    :param paths: 目录（递归查找 .mc 文件）、通配符或文件
+    :param out_dir: 输出目录，为 None 时输出到源文件所在目录；目录参数下的文件保持相对路径
+    :return: [(源文件, 输出文件)]
+    """
+    res = []
+    for path in paths:
+        if os.path.isdir(path):
+            root = path
+            sources = sorted(glob.glob(os.path.join(path, "**", "*" + SOURCE_SUFFIX), recursive=True))
+        else:
+            root = None
+            sources = sorted(glob.glob(path, recursive=True)) if glob.has_magic(path) else [path]
+        for source in sources:
+            target = os.path.splitext(source)[0] + MIDI_SUFFIX
+            if out_dir is not None:
+                name = os.path.relpath(target, root) if root else os.path.basename(target)
+                target = os.path.join(out_dir, name)
+            res.append((source, target))
+    return res
+
+
+def is_outdated(source, target):
+    """
+    输出文件不存在或比源文件旧时需要转换
+    """
+    return not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source)
+
+
+def convert_one(source, target, key="C", width=8, optimize=False):
+    """
+    转换单个文件，供进程池调用
+    :return: 源文件、输出文件、耗时（秒）、源文件字节数
+    """
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    MidiWriter(source, target).write(key, width, optimize=optimize)
+    return source, target, time.perf_counter() - start, os.path.getsize(source)
+
+
+def convert_batch(paths, out_dir=None, jobs=None, force=False, key="C", width=8, optimize=False):
+    """
+    批量转换，跳过比源文件新的输出文件，逐个打印耗时并统计吞吐量
+    :param jobs: 进程数，None 表示 CPU 核数
+    :param force: 为真时不跳过任何文件
+    :return: 转换的文件数
+    """
+    start = time.perf_counter()
+    pairs = collect_sources(paths, out_dir)
+    todo = [pair for pair in pairs if force or is_outdated(*pair)]
+    total_bytes = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(convert_one, source, target, key, width, optimize) for source, target in todo]
+        for future in futures:
+            source, target, seconds, size = future.result()
+            total_bytes += size
+            print("{0} -> {1}  {2:.1f}ms".format(source, target, seconds * 1000))
+    elapsed = time.perf_counter() - start
+    print(
+        "转换 {0} 个文件，跳过 {1} 个，耗时 {2:.2f}s，{3:.1f} 文件/s，{4:.1f} KB/s".format(
+            len(todo),
+            len(pairs) - len(todo),
+            elapsed,
+            len(todo) / elapsed if elapsed else 0,
+            total_bytes / 1024 / elapsed if elapsed else 0,
+        )
+    )
+    return len(todo)
@@ -0,0 +1,130 @@
+# 编码选择：为给定源代码选择音符事件最少的调性与取反掩码
+import heapq
+import sys
+from array import array
+from collections import Counter
+
+from .midi_parser import get_codec, key_dict
+from .midi_reader import WORD_TYPECODES
+
+__author__ = "mori"
+
+
+class EncodingStats:
+    """
+    源代码的编码统计：每 8 位一组的字节直方图与出现过的编码单元
+    """
+
+    def __init__(self, width=8):
+        self.width = width
+        self.word_bytes = width // 8
+        self.histograms = [Counter() for _ in range(self.word_bytes)]
+        self.units = set()  # 出现过的编码单元，8 位时由直方图得到
+        self.count = 0  # 编码单元数
+        self.__rest = b""  # 上一块结尾不足一个编码单元的字节
+
+    def update(self, data: bytes):
+        """
+        统计一块源代码字节
+        """
+        word_bytes = self.word_bytes
+        data = self.__rest + data
+        end = len(data) - len(data) % word_bytes
+        self.__rest = data[end:]
+        self.__count(data[:end])
+
+    def finish(self):
+        """
+        统计结尾补 0 后的编码单元
+        """
+        if self.__rest:
+            self.__count(self.__rest + b"\0" * (self.word_bytes - len(self.__rest)))
+            self.__rest = b""
+        return self
+
+    def __count(self, data):
+        word_bytes = self.word_bytes
+        for lane in range(word_bytes):
+            self.histograms[lane].update(data[lane::word_bytes])
+        self.count += len(data) // word_bytes
+        if word_bytes > 1:
+            words = array(WORD_TYPECODES[self.width])
+            words.frombytes(data)
+            if sys.byteorder == "big":
+                words.byteswap()
+            self.units.update(words)
+
+    def has_unit(self, code):
+        if self.word_bytes == 1:
+            return self.histograms[0][code] > 0
+        return code in self.units
+
+    def bit_counts(self):
+        """
+        :return: 每个比特位为 1 的编码单元数
+        """
+        res = []
+        for histogram in self.histograms:
+            for bit in range(8):
+                res.append(sum(n for b, n in histogram.items() if b & (1 << bit)))
+        return res
+
+    def count_events(self, key, mask=0):
+        """
+        按调性与取反掩码编码时的音符事件数（按下、抬起各算一个）
+        """
+        codec = get_codec(key, self.width)
+        total = 0
+        for lane, histogram in enumerate(self.histograms):
+            chords = codec.lanes[lane]
+            lane_mask = (mask >> (8 * lane)) & 0xFF
+            total += sum(n * len(chords[b ^ lane_mask]) for b, n in histogram.items())
+        return total * 2
+
+
+def choose_mask(stats: EncodingStats) -> int:
+    """
+    选择取反掩码：比特位为 1 的编码单元超过一半时取反该位
+    编码后为 0 的编码单元没有音符，无法表示，因此掩码不能等于任何出现过的编码单元；
+    最优掩码冲突时，按增加的事件数从小到大依次尝试翻转部分比特位
+    """
+    counts = stats.bit_counts()
+    best = 0
+    for bit, ones in enumerate(counts):
+        if ones * 2 > stats.count:
+            best |= 1 << bit
+    if not stats.has_unit(best):
+        return best
+    # 翻转比特位 i 增加的事件数为 |2 * ones - count|，按代价从小到大枚举翻转组合
+    costs = sorted((abs(2 * ones - stats.count), bit) for bit, ones in enumerate(counts))
+    heap = [(costs[0][0], 0, best ^ (1 << costs[0][1]))]
+    while heap:
+        cost, last, mask = heapq.heappop(heap)
+        if not stats.has_unit(mask):
+            return mask
+        if last + 1 < len(costs):
+            next_cost, next_bit = costs[last + 1]
+            last_bit = costs[last][1]
+            # 替换最后翻转的比特位，或者追加翻转下一个比特位
+            heapq.heappush(
+                heap,
+                (cost - costs[last][0] + next_cost, last + 1, mask ^ (1 << last_bit) ^ (1 << next_bit)),
+            )
+            heapq.heappush(heap, (cost + next_cost, last + 1, mask ^ (1 << next_bit)))
+    return 0  # 所有掩码都与编码单元冲突，不取反
+
+
+def choose_encoding(stats: EncodingStats, default_key="C"):
+    """
+    评估所有调性与取反掩码，选择音符事件最少的编码
+    每个比特位对应一个音，事件数只取决于为 1 的比特位数，各调性的结果通常相同，相同时保留默认调性
+    :return: 调性、掩码、事件数
+    """
+    mask = choose_mask(stats)
+    best_key = default_key
+    best_events = stats.count_events(default_key, mask)
+    for key in key_dict:
+        events = stats.count_events(key, mask)
+        if events < best_events:
+            best_key, best_events = key, events
+    return best_key, mask, best_events
@@ -34,21 +34,129 @@ key_dict = {
 }
 
 
+WORD_WIDTHS = (8, 16, 32)  # 支持的字长：每个和弦表示的比特数
+ENCODING_META = "midic:"  # 记录编码参数的文本元事件前缀，如 midic:width=16
+
+
+def key_notes(key: str, width=8) -> list[int]:
+    """
+    调内音表：从调的第一个音开始，按音阶向上取 width 个调内音
+    width 为 8 时即 key_dict 中的音符表，16、32 位分别跨越约两个、四个八度
+    """
+    if key not in key_dict:
+        raise ValueError(f"Invalid key: {key}")
+    if width not in WORD_WIDTHS:
+        raise ValueError(f"Invalid word width: {width}")
+    degrees = key_dict[key][:7]
+    return [degrees[i % 7] + 12 * (i // 7) for i in range(width)]
+
+
+def format_encoding(**params) -> str:
+    """
+    编码参数转为文本元事件内容
+    """
+    return ENCODING_META + ";".join("{0}={1}".format(k, v) for k, v in params.items())
+
+
+def parse_encoding(text: str):
+    """
+    解析文本元事件中的编码参数
+    :return: 参数字典，不是编码参数时返回 None
+    """
+    if not text.startswith(ENCODING_META):
+        return None
+    params = {}
+    for item in text[len(ENCODING_META):].split(";"):
+        name, _, value = item.partition("=")
+        params[name] = int(value)
+    return params
+
+
+class KeyCodec:
+    """
+    调性编解码表，每个调、字长只构建一次
+    note_bits: 128 项，音符 -> 比特位，不在音符表的音符为 0
+    lanes: 每 8 位一组，256 项，字节 -> 音符元组；chords 为最低 8 位一组
+    宽字长时，字节按小端序打包为一个编码单元，即第一个字节对应最低 8 位
+    """
+
+    def __init__(self, key: str, width=8):
+        alphabet = key_notes(key, width)
+        self.key = key
+        self.width = width
+        self.word_bytes = width // 8  # 每个和弦表示的字节数
+        note_bits = [0] * 128
+        for i, note in enumerate(alphabet):
+            note_bits[note] |= 1 << i
+        self.note_bits = tuple(note_bits)
+        self.lanes = tuple(
+            tuple(
+                tuple(note for i, note in enumerate(alphabet[lane:lane + 8]) if code & (1 << i))
+                for code in range(256)
+            )
+            for lane in range(0, width, 8)
+        )
+        self.chords = self.lanes[0]
+
+    def decode(self, chords) -> bytes:
+        """
+        批量解码：和弦序列（每项为音符序列）转为字节串
+        """
+        note_bits = self.note_bits
+        word_bytes = self.word_bytes
+        res = bytearray()
+        for chord in chords:
+            code = 0
+            for note in chord:
+                code |= note_bits[note]
+            if word_bytes == 1:
+                res.append(code)
+            else:
+                res += code.to_bytes(word_bytes, "little")
+        return bytes(res)
+
+    def encode(self, data) -> list[tuple[int, ...]]:
+        """
+        批量编码：字节串或字符串转为和弦序列，字符取最低 8 位
+        宽字长时每个和弦打包多个字节，结尾不足的部分补 0
+        """
+        if isinstance(data, str):
+            # utf-32-le 每个字符 4 字节，步长 4 取得每个字符的最低字节
+            data = data.encode("utf-32-le")[::4]
+        if self.word_bytes == 1:
+            chords = self.chords
+            return [chords[b] for b in data]
+        lanes = self.lanes
+        word_bytes = self.word_bytes
+        data = bytes(data) + b"\0" * (-len(data) % word_bytes)
+        return [
+            sum((lanes[k][data[i + k]] for k in range(word_bytes)), ())
+            for i in range(0, len(data), word_bytes)
+        ]
+
+
+_codec_cache = {}  # (调性, 字长) -> KeyCodec
+
+
+def get_codec(key: str, width=8) -> KeyCodec:
+    """
+    获取调性对应的编解码表，按调、字长缓存
+    """
+    codec = _codec_cache.get((key, width))
+    if codec is None:
+        codec = _codec_cache[key, width] = KeyCodec(key, width)
+    return codec
+
+
 def from_char(key: str, c: str) -> list[int]:
     """
     将字符转换为音符
     字符处理为 8 位 ASCII 码，即转为整数，取最低 8 位
     """
-    if key not in key_dict:
-        raise ValueError(f"Invalid key: {key}")
+    codec = get_codec(key)
     if len(c) != 1:
         raise ValueError(f"Invalid character: {c}")
-    valid_bits = ord(c) & 0b11111111
-    res = []
-    for i, note in enumerate(key_dict[key]):
-        if valid_bits & (1 << i):
-            res.append(note)
-    return res
+    return list(codec.chords[ord(c) & 0b11111111])
 
 
 def to_char(key: str, notes: list[int]) -> str:
@@ -56,23 +164,14 @@ def to_char(key: str, notes: list[int]) -> str:
     将音符转换为字符
     音符列表转为整数低 8 位，处理为 ASCII 码对应字符
     """
-    if key not in key_dict:
-        raise ValueError(f"Invalid key: {key}")
+    codec = get_codec(key)
     if len(notes) > 8:
         raise ValueError(f"Invalid notes: {notes}")
-    valid_bits = 0
-    for i, note in enumerate(key_dict[key]):
-        if note in notes:
-            valid_bits |= 1 << i
-    return chr(valid_bits)
+    return chr(codec.decode((notes,))[0])
 
 
 def get_score_bit(key: str, note: int) -> int:
     if key not in key_dict:
         raise ValueError("Invalid key signature")
-    alphabet = key_dict[key]
-    for i, a_note in enumerate(alphabet):
-        if a_note == note:
-            return 1 << i
-    # 不在音符表，忽略
-    return 0
+    # 不在音符表的音符为 0，忽略
+    return get_codec(key).note_bits[note]
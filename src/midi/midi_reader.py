@@ -1,54 +1,233 @@
 # 把 midi 文件当字符流来读取
-from mido import MidiFile
+import sys
+from array import array
+from itertools import islice
 
-from .midi_parser import get_score_bit
+from .midi_parser import get_codec, parse_encoding
+from .smf_reader import SmfError, SmfTrackReader
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖，没有 numpy 时使用逐事件解码
+    np = None
 
 __author__ = "mori"
 
 
+WORD_TYPECODES = {16: "H", 32: "I"}  # 宽字长编码单元对应的 array 类型
+NUMPY_DTYPES = {8: "u1", 16: "<u2", 32: "<u4"}
+CHUNK_SIZE = 4096  # 流式读取时每块的和弦数
+
+
 class MidiReader:
-    def __init__(self, file_in: str):
+    def __init__(self, file_in: str, native=True, vectorize=None):
+        """
+        :param file_in: MIDI 文件名
+        :param native: 是否直接解析 SMF，解析失败或为假时使用 mido
+        :param vectorize: read_all 是否使用 numpy 向量化解码，None 表示安装了 numpy 时使用
+        """
         self.filepath = file_in
-        self.msg_index = 0
+        if vectorize and np is None:
+            raise ImportError("向量化解码需要安装 numpy")
+        self.vectorize = np is not None if vectorize is None else vectorize
         self.key_signature = "C"
+        self.encoding = {}  # 编码参数，如字长
+        self.smf = None
+        if native:
+            try:
+                self.smf = SmfTrackReader(self.filepath)
+            except SmfError:
+                self.smf = None  # 回退到 mido
+        if self.smf is not None:
+            self.key_signature = self.smf.key_signature
+            self.encoding = self.smf.encoding
+        else:
+            self.__load_mido()
+        self.width = self.encoding.get("width", 8)  # 字长，每个和弦表示的比特数
+        self.word_bytes = self.width // 8
+        self.mask = self.encoding.get("xor", 0)  # 取反掩码，解码后的编码单元需要再与掩码异或
+        self.note_bits = get_codec(self.key_signature, self.width).note_bits  # 音符 -> 比特位查找表
+        self.__bytes = None  # 逐字节读取时的生成器
+        self.__next_code = None  # 预读的字节
+
+    def close(self):
+        """
+        关闭直接解析的 MIDI 文件
+        """
+        if self.smf is not None:
+            self.smf.close()
+
+    def __load_mido(self):
+        from mido import MidiFile
+
         self.file = MidiFile(self.filepath)
         self.track = self.file.tracks[0]
-        self.msg_index = 0
+        msg_index = 0
         # 获得 Track 调性
-        while self.track[self.msg_index].type != "key_signature":
-            self.msg_index += 1
-        self.key_signature = self.track[self.msg_index].key
+        while self.track[msg_index].type != "key_signature":
+            msg_index += 1
+        self.key_signature = self.track[msg_index].key
+        # 第一个音符前的文本元事件可能记录了编码参数
+        for msg in self.track:
+            if msg.type == "note_on":
+                break
+            if msg.type == "text":
+                params = parse_encoding(msg.text)
+                if params is not None:
+                    self.encoding = params
+                    break
+
+    def read_all(self, with_index=False):
+        """
+        一次性解码整个轨道
+        :param with_index: 为真时同时返回每个字符对应的首个 MIDI 事件序号
+        :return: 字节串；with_index 为真时返回 (字节串, array('I'))
+        """
+        if self.vectorize:
+            text, indices = self.__read_all_numpy(with_index)
+        else:
+            indices = array("I") if with_index else None
+            text = self.__pack(self.__codes(indices))
+        if self.word_bytes > 1:
+            text, indices = self.__unpack(text, indices)
+        return (text, indices) if with_index else text
+
+    def read_chunks(self, size=CHUNK_SIZE):
+        """
+        逐块解码轨道，只保留当前块，内存占用与块大小相关
+        :param size: 每块的和弦数
+        :return: 生成器，产出字节串
+        """
+        codes = self.__codes()
+        last = None  # 宽字长时最后一块需要去掉补齐的 0，因此延迟一块产出
+        while True:
+            chunk = self.__pack(islice(codes, size))
+            if not chunk:
+                break
+            if last is not None:
+                yield last
+            last = chunk
+        if last is not None:
+            if self.word_bytes > 1:
+                last = self.__unpack(last, None)[0]
+            yield last
+
+    def __pack(self, codes):
+        """
+        编码单元按小端序打包为字节串
+        """
+        if self.word_bytes == 1:
+            return bytes(codes)
+        words = array(WORD_TYPECODES[self.width], codes)
+        if sys.byteorder == "big":
+            words.byteswap()
+        return words.tobytes()
+
+    def __unpack(self, text, indices):
+        """
+        宽字长：事件序号扩展到每个字节，并去掉结尾编码单元中补齐的 0
+        """
+        word_bytes = self.word_bytes
+        length = max(len(text.rstrip(b"\0")), len(text) - word_bytes + 1)
+        text = text[:length]
+        if indices is not None:
+            indices = array("I", (i for i in indices for _ in range(word_bytes)))[:length]
+        return text, indices
+
+    def __read_all_numpy(self, with_index):
+        """
+        向量化解码：和弦合并即按 delta 不为 0 的位置分段，对各段比特位做按位或
+        """
+        if self.smf is not None:
+            events = self.smf.note_events()
+        else:
+            events = self.__note_events_mido()
+        index, delta, note, velocity = (np.frombuffer(a, dtype=a.typecode) for a in events)
+        keep = velocity != 0  # 忽略 velocity 为 0 的音符
+        index, delta, note = index[keep], delta[keep], note[keep]
+        indices = array("I") if with_index else None
+        if len(note) == 0:
+            return b"", indices
+        bits = np.asarray(self.note_bits, dtype=NUMPY_DTYPES[self.width])[note]
+        is_start = delta != 0
+        is_start[0] = True  # 第一个音符总是和弦起点
+        starts = np.flatnonzero(is_start)
+        codes = np.bitwise_or.reduceat(bits, starts)
+        if self.mask:
+            codes ^= bits.dtype.type(self.mask)
+        text = codes.tobytes()
+        if with_index:
+            indices.frombytes(index[starts].astype(indices.typecode).tobytes())
+        return text, indices
+
+    def __note_events_mido(self):
+        indices = array("I")
+        deltas = array("I")
+        notes = array("B")
+        velocities = array("B")
+        for index, msg in enumerate(self.track):
+            if msg.type == "note_on":
+                indices.append(index)
+                deltas.append(msg.time)
+                notes.append(msg.note)
+                velocities.append(msg.velocity)
+        return indices, deltas, notes, velocities
+
+    def __codes(self, indices=None):
+        """
+        和弦编码生成器
+        """
+        if self.smf is not None:
+            codes = self.smf.chords(self.note_bits, indices)
+        else:
+            codes = self.__chords_mido(indices)
+        if self.mask:
+            mask = self.mask
+            codes = (code ^ mask for code in codes)
+        return codes
+
+    def __chords_mido(self, indices):
+        # 如果音符的 time 为 0，除第一个音符以外，均需要和前一个音符合并，忽略 velocity 为 0 的音符
+        note_bits = self.note_bits
+        code = 0
+        started = False
+        for index, msg in enumerate(self.track):
+            if msg.type != "note_on" or msg.velocity == 0:
+                continue
+            if started and msg.time == 0:
+                code |= note_bits[msg.note]
+                continue
+            if started:
+                yield code
+            started = True
+            code = note_bits[msg.note]
+            if indices is not None:
+                indices.append(index)
+        if started:
+            yield code
+
+    def __iter_bytes(self):
+        word_bytes = self.word_bytes
+        for code in self.__codes():
+            if word_bytes == 1:
+                yield code
+            else:
+                yield from code.to_bytes(word_bytes, "little")
 
     def has_msg(self):
-        # 轨道为空，空midi文件
-        if len(self.track) == 0:
-            return False
-        # 音符栈没有音符，说明所有音符都已经结束
-        # 查找下一个音符的开始位置，忽略 velocity 为 0 的音符（仅考虑音符开始的时间）
-        while self.msg_index < len(self.track) and (
-            self.track[self.msg_index].type != "note_on"
-            or self.track[self.msg_index].velocity == 0
-        ):
-            self.msg_index += 1
-            if self.msg_index >= len(self.track):
-                return False
-        return self.msg_index < len(self.track)
+        if self.__bytes is None:
+            iter(self)
+        return self.__next_code is not None
 
     def __iter__(self):
-        self.msg_index = 0
+        self.__bytes = self.__iter_bytes()
+        self.__next_code = next(self.__bytes, None)
         return self
 
     def __next__(self):
-        code = 0
-        only_zero_time = False
-        # 查找下一个音符的开始位置，如果音符的 time 为 0，除第一个音符以外，均需要和前一个音符合并
-        while self.has_msg() and (
-            not only_zero_time or self.track[self.msg_index].time == 0
-        ):
-            now_code = get_score_bit(
-                self.key_signature, self.track[self.msg_index].note
-            )
-            code |= now_code
-            only_zero_time = True
-            self.msg_index += 1
+        # 音符读完后持续返回 0
+        code = self.__next_code
+        if code is None:
+            return 0
+        self.__next_code = next(self.__bytes, None)
         return code
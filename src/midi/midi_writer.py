@@ -1,17 +1,31 @@
+import argparse
+import io
 import sys
-from mido import MetaMessage, MidiFile, MidiTrack, Message
 
-from .midi_parser import from_char
+from .midi_optimizer import EncodingStats, choose_encoding
+from .midi_parser import WORD_WIDTHS, format_encoding, from_char, get_codec
+from .smf_writer import (
+    SmfTrackWriter,
+    chord_events,
+    join_chord,
+    key_signature_data,
+    lane_events,
+)
 
 __author__ = "mori"
 
+CHUNK_SIZE = 1 << 16  # 流式读取源代码的块大小
+
 
 class MidiWriter:
     def __init__(self, input_file: str, output_file: str):
         self.output_file = output_file
         self.input_file = input_file
+        self.encoding_events = None  # 编码优化前后的音符事件数
 
     def _init_track(self, signature="C"):
+        from mido import MetaMessage, MidiTrack, Message
+
         # 逐个字符解析，并添加到 track
         track = MidiTrack()
         track.append(MetaMessage("track_name", name="Piano", time=0))
@@ -36,6 +50,11 @@ class MidiWriter:
         return track
 
     def parse(self):
+        """
+        使用 mido 构建消息对象并保存，整个源文件读入内存
+        """
+        from mido import MetaMessage, MidiFile, Message
+
         # 读取 input_file 的文本内容
         code_content = open(self.input_file, "r").read()
         # 逐个字符解析，并添加到 track
@@ -76,11 +95,151 @@ class MidiWriter:
         mid.tracks.append(track)
         mid.save(self.output_file)
 
+    def write(self, key="C", width=8, mask=0, optimize=False):
+        """
+        流式读取源代码，直接写出 SMF 字节，文件名为 - 时使用标准输入、输出
+        :param width: 字长，16、32 位时每个和弦打包 2、4 个字节
+        :param mask: 取反掩码，编码单元与掩码异或后再转为音符
+        :param optimize: 为真时先统计源代码，选择音符事件最少的调性与取反掩码
+        """
+        src = sys.stdin if self.input_file == "-" else open(self.input_file, "r")
+        out = None
+        try:
+            if optimize:
+                if src is sys.stdin:
+                    src = io.StringIO(src.read())  # 需要读取两遍
+                key, mask = self.__optimize(src, key, width)
+                src.seek(0)
+            codec = get_codec(key, width)
+            out = sys.stdout.buffer if self.output_file == "-" else open(self.output_file, "wb")
+            writer = SmfTrackWriter(out)
+            self._write_header(writer, key, width, mask)
+            if width == 8:
+                self.__write_bytes(writer, codec, src, mask)
+            else:
+                self.__write_words(writer, codec, src, mask)
+            writer.close()
+        finally:
+            if src is not sys.stdin:
+                src.close()
+            if out is not None and out is not sys.stdout.buffer:
+                out.close()
+
+    def __optimize(self, src, key, width):
+        stats = EncodingStats(width)
+        for data in self.__read_chunks(src):
+            stats.update(data)
+        stats.finish()
+        best_key, mask, events = choose_encoding(stats, key)
+        self.encoding_events = (stats.count_events(key), events)  # 优化前后的音符事件数
+        return best_key, mask
+
+    @staticmethod
+    def __read_chunks(src):
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), ""):
+            # utf-32-le 每个字符 4 字节，步长 4 取得每个字符的最低字节
+            yield chunk.encode("utf-32-le")[::4]
+
+    def __write_bytes(self, writer, codec, src, mask):
+        # 取反掩码等价于按掩码重排编码表
+        events = chord_events(codec.chords)
+        events = tuple(events[b ^ mask] for b in range(256))
+        lanes = lane_events(codec.chords)
+        lanes = tuple(lanes[b ^ mask] for b in range(256))
+        silent = bytes((mask,))  # 编码后没有音符的字符
+        leading_node = True
+        for data in self.__read_chunks(src):
+            if leading_node:
+                data = data.lstrip(silent)  # 没有音符的字符不产生事件
+                if not data:
+                    continue
+                # 第一个和弦没有间隔，并写入状态字节
+                writer.notes(join_chord(*lanes[data[0]], leading=True))
+                data = data[1:]
+                leading_node = False
+            writer.notes(b"".join(map(events.__getitem__, data)))
+
+    def __write_words(self, writer, codec, src, mask):
+        lanes = []
+        for lane, chords in enumerate(codec.lanes):
+            events = lane_events(chords)
+            lane_mask = (mask >> (8 * lane)) & 0xFF
+            lanes.append(tuple(events[b ^ lane_mask] for b in range(256)))
+        word_bytes = codec.word_bytes
+        leading_node = True
+        rest = b""  # 上一块结尾不足一个编码单元的字节
+        chunks = self.__read_chunks(src)
+        for data in chunks:
+            data = rest + data
+            end = len(data) - len(data) % word_bytes
+            rest = data[end:]
+            leading_node = self.__write_word_chunk(writer, lanes, data[:end], leading_node)
+        if rest:  # 结尾补 0
+            rest += b"\0" * (word_bytes - len(rest))
+            self.__write_word_chunk(writer, lanes, rest, leading_node)
+
+    @staticmethod
+    def __write_word_chunk(writer, lanes, data, leading_node):
+        word_bytes = len(lanes)
+        res = []
+        for i in range(0, len(data), word_bytes):
+            on = b"".join(lanes[k][data[i + k]][0] for k in range(word_bytes))
+            if not on:
+                continue
+            off = b"".join(lanes[k][data[i + k]][1] for k in range(word_bytes))
+            res.append(join_chord(on, off, leading_node))
+            leading_node = False
+        writer.notes(b"".join(res))
+        return leading_node
+
+    @staticmethod
+    def _write_header(writer, signature="C", width=8, mask=0):
+        """
+        写入与 _init_track 相同的轨道开头事件，宽字长或取反时以文本元事件记录编码参数
+        """
+        writer.meta(0x03, b"Piano")  # track_name
+        if width != 8 or mask:
+            writer.meta(0x01, format_encoding(width=width, xor=mask).encode())  # text
+        writer.meta(0x58, bytes((4, 2, 32, 8)))  # time_signature 4/4
+        writer.meta(0x59, key_signature_data(signature))
+        writer.meta(0x51, (800000).to_bytes(3, "big"))  # set_tempo
+        writer.message(0xB0, 121, 0)
+        writer.message(0xC0, 0)
+        writer.message(0xB0, 7, 100)
+        writer.message(0xB0, 10, 64)
+        writer.message(0xB0, 91, 0)
+        writer.message(0xB0, 93, 0)
+        writer.meta(0x21, b"\0")  # midi_port
+
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python -m src.midi.midi_writer input_file output_file")
-        exit(1)
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    MidiWriter(input_file, output_file).parse()
+    parser = argparse.ArgumentParser(
+        prog="python -m src.midi.midi_writer", description="将代码转为 midi 文件"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="源代码文件与输出的 midi 文件，- 表示标准输入、输出；--batch 时为目录、通配符或文件",
+    )
+    parser.add_argument("--width", type=int, choices=WORD_WIDTHS, default=8, help="字长，默认 8 位")
+    parser.add_argument("--optimize", action="store_true", help="选择音符事件最少的调性与取反掩码")
+    parser.add_argument("--mido", action="store_true", help="使用 mido 生成（整个文件读入内存，仅支持 8 位）")
+    parser.add_argument("--batch", action="store_true", help="批量转换，输出文件与源文件同名，后缀为 .mid")
+    parser.add_argument("-o", "--out-dir", help="批量转换的输出目录，默认为源文件所在目录")
+    parser.add_argument("-j", "--jobs", type=int, help="批量转换的进程数，默认为 CPU 核数")
+    parser.add_argument("--force", action="store_true", help="批量转换时不跳过比源文件新的输出文件")
+    args = parser.parse_args()
+    if args.batch:
+        from .midi_batch import convert_batch
+
+        convert_batch(args.paths, args.out_dir, args.jobs, args.force, width=args.width, optimize=args.optimize)
+        sys.exit(0)
+    if len(args.paths) != 2:
+        parser.error("需要指定源代码文件与输出的 midi 文件")
+    midi_writer = MidiWriter(*args.paths)
+    if args.mido:
+        midi_writer.parse()
+    else:
+        midi_writer.write(width=args.width, optimize=args.optimize)
+        if midi_writer.encoding_events and args.paths[1] != "-":
+            print("音符事件数：{0} -> {1}".format(*midi_writer.encoding_events))
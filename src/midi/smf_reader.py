@@ -0,0 +1,234 @@
+# 直接解析标准 MIDI 文件（SMF），只遍历第一个 MTrk 块，不构建 mido 消息对象
+import mmap
+import struct
+from array import array
+
+from .midi_parser import parse_encoding
+
+__author__ = "mori"
+
+# key_signature 元事件中 sf 取值 -7~7 对应的调性名称
+MAJOR_KEYS = ("Cb", "Gb", "Db", "Ab", "Eb", "Bb", "F", "C", "G", "D", "A", "E", "B", "F#", "C#")
+MINOR_KEYS = ("Abm", "Ebm", "Bbm", "Fm", "Cm", "Gm", "Dm", "Am", "Em", "Bm", "F#m", "C#m", "G#m", "D#m", "A#m")
+
+META_TEXT = 0x01
+META_KEY_SIGNATURE = 0x59
+# 系统公共消息的数据长度，未列出的为 0
+SYSTEM_DATA_LEN = {0xF1: 1, 0xF2: 2, 0xF3: 1}
+
+
+class SmfError(ValueError):
+    """
+    SMF 文件结构错误，调用方可据此回退到 mido
+    """
+
+
+class SmfTrackReader:
+    """
+    SMF 第一轨道读取类，内存映射文件，事件在循环内直接解码
+    """
+
+    def __init__(self, file_in):
+        with open(file_in, "rb") as file:
+            try:
+                self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # 空文件无法映射
+                raise SmfError("空文件")
+        try:
+            self.start, self.end = self.__locate_track()
+            self.key_signature = None
+            self.encoding = {}  # 文本元事件记录的编码参数
+            self.__scan_header()
+        except IndexError:
+            raise SmfError("文件不完整")
+
+    def __locate_track(self):
+        """
+        校验文件头并定位第一个 MTrk 块
+        :return: 轨道数据的起止位置
+        """
+        data = self.data
+        if len(data) < 14 or data[:4] != b"MThd":
+            raise SmfError("不是标准 MIDI 文件")
+        pos = 8 + struct.unpack_from(">I", data, 4)[0]  # 跳过文件头块
+        while pos + 8 <= len(data):
+            chunk_type = data[pos:pos + 4]
+            chunk_len = struct.unpack_from(">I", data, pos + 4)[0]
+            pos += 8
+            if chunk_type == b"MTrk":
+                return pos, min(pos + chunk_len, len(data))
+            pos += chunk_len  # 忽略未知块
+        raise SmfError("没有找到轨道")
+
+    def __scan_header(self):
+        """
+        扫描轨道，获得 Track 调性，以及第一个音符前的编码参数
+        """
+        data = self.data
+        pos = self.start
+        end = self.end
+        status = 0
+        note_seen = encoding_seen = False
+        while pos < end and not (self.key_signature and (note_seen or encoding_seen)):
+            while data[pos] & 0x80:  # 跳过 delta 时间
+                pos += 1
+            pos += 1
+            byte = data[pos]
+            if byte == 0xFF:  # 元事件
+                meta_type = data[pos + 1]
+                pos, length = self.__read_var_len(pos + 2)
+                if meta_type == META_KEY_SIGNATURE and not self.key_signature:
+                    self.key_signature = self.__key_name(data[pos], data[pos + 1])
+                elif meta_type == META_TEXT and not note_seen and not encoding_seen:
+                    params = parse_encoding(data[pos:pos + length].decode("latin-1"))
+                    if params is not None:
+                        self.encoding = params
+                        encoding_seen = True
+                pos += length
+            elif byte == 0xF0 or byte == 0xF7:  # 系统独占消息
+                pos, length = self.__read_var_len(pos + 1)
+                pos += length
+                status = 0
+            else:
+                if byte & 0x80:
+                    status = byte
+                    pos += 1
+                elif not status:
+                    raise SmfError("没有可用的运行状态")
+                note_seen = note_seen or status & 0xF0 == 0x90
+                pos += self.__data_len(status)
+        if not self.key_signature:
+            raise SmfError("没有找到调号")
+
+    def chords(self, note_bits, indices=None):
+        """
+        按和弦逐个产生字符编码：time 为 0 的 note_on 与前一个 note_on 合并，忽略 velocity 为 0 的音符
+        :param note_bits: 音符 -> 比特位查找表
+        :param indices: 不为 None 时，追加每个和弦首个 note_on 在轨道中的事件序号
+        """
+        data = self.data
+        pos = self.start
+        end = self.end
+        status = 0
+        code = 0
+        started = False
+        index = -1  # 事件序号
+        while pos < end:
+            index += 1
+            # 变长 delta 时间
+            byte = data[pos]
+            pos += 1
+            delta = byte & 0x7F
+            while byte & 0x80:
+                byte = data[pos]
+                pos += 1
+                delta = (delta << 7) | (byte & 0x7F)
+            byte = data[pos]
+            if byte == 0xFF:
+                pos, length = self.__read_var_len(pos + 2)
+                pos += length
+                continue
+            if byte == 0xF0 or byte == 0xF7:
+                pos, length = self.__read_var_len(pos + 1)
+                pos += length
+                status = 0
+                continue
+            if byte & 0x80:
+                status = byte
+                pos += 1
+            elif not status:
+                raise SmfError("没有可用的运行状态")
+            if status & 0xF0 == 0x90 and data[pos + 1]:  # note_on 且 velocity 不为 0
+                if started and delta == 0:
+                    code |= note_bits[data[pos]]
+                else:
+                    if started:
+                        yield code
+                    started = True
+                    code = note_bits[data[pos]]
+                    if indices is not None:
+                        indices.append(index)
+                pos += 2
+            else:
+                pos += self.__data_len(status)
+        if started:
+            yield code
+
+    def note_events(self):
+        """
+        一次遍历取出轨道中全部 note_on 事件，供向量化解码使用
+        :return: 事件序号、delta 时间、音符、力度四个 array
+        """
+        data = self.data
+        pos = self.start
+        end = self.end
+        status = 0
+        index = -1
+        indices = array("I")
+        deltas = array("I")
+        notes = array("B")
+        velocities = array("B")
+        while pos < end:
+            index += 1
+            byte = data[pos]
+            pos += 1
+            delta = byte & 0x7F
+            while byte & 0x80:
+                byte = data[pos]
+                pos += 1
+                delta = (delta << 7) | (byte & 0x7F)
+            byte = data[pos]
+            if byte == 0xFF:
+                pos, length = self.__read_var_len(pos + 2)
+                pos += length
+                continue
+            if byte == 0xF0 or byte == 0xF7:
+                pos, length = self.__read_var_len(pos + 1)
+                pos += length
+                status = 0
+                continue
+            if byte & 0x80:
+                status = byte
+                pos += 1
+            elif not status:
+                raise SmfError("没有可用的运行状态")
+            if status & 0xF0 == 0x90:
+                indices.append(index)
+                deltas.append(delta)
+                notes.append(data[pos])
+                velocities.append(data[pos + 1])
+                pos += 2
+            else:
+                pos += self.__data_len(status)
+        return indices, deltas, notes, velocities
+
+    def close(self):
+        self.data.close()
+
+    def __read_var_len(self, pos):
+        """
+        读取变长整数
+        :return: 读取后的位置，整数值
+        """
+        data = self.data
+        value = 0
+        byte = 0x80
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            value = (value << 7) | (byte & 0x7F)
+        return pos, value
+
+    @staticmethod
+    def __data_len(status):
+        if status < 0xF0:
+            return 1 if 0xC0 <= status < 0xE0 else 2
+        return SYSTEM_DATA_LEN.get(status, 0)
+
+    @staticmethod
+    def __key_name(sf, mi):
+        if sf > 127:  # 有符号字节
+            sf -= 256
+        if not -7 <= sf <= 7:
+            raise SmfError("无效的调号：{}".format(sf))
+        return (MINOR_KEYS if mi else MAJOR_KEYS)[sf + 7]
@@ -0,0 +1,151 @@
+# 直接生成标准 MIDI 文件（SMF）字节，使用运行状态，不构建 mido 消息对象
+import shutil
+import struct
+import tempfile
+
+from .smf_reader import MAJOR_KEYS, MINOR_KEYS
+
+__author__ = "mori"
+
+NOTE_ON = 0x90  # 通道 0 的 note_on
+VELOCITY = 80
+NOTE_GAP = 13  # 和弦之间的间隔
+NOTE_LENGTH = 227  # 音符时值，与间隔合计 240，即 8 分音符
+
+
+def var_len(value: int) -> bytes:
+    """
+    编码变长整数
+    """
+    res = bytearray((value & 0x7F,))
+    value >>= 7
+    while value:
+        res.append((value & 0x7F) | 0x80)
+        value >>= 7
+    res.reverse()
+    return bytes(res)
+
+
+def key_signature_data(key: str) -> bytes:
+    """
+    调性名称转为 key_signature 元事件数据（sf, mi）
+    """
+    keys = MINOR_KEYS if key.endswith("m") else MAJOR_KEYS
+    if key not in keys:
+        raise ValueError(f"Invalid key: {key}")
+    return struct.pack("bB", keys.index(key) - 7, keys is MINOR_KEYS)
+
+
+class SmfTrackWriter:
+    """
+    单轨道 SMF 写入类：先写入轨道长度占位，结束时回填
+    输出流不可定位（如管道）时，轨道先写入临时文件，结束时整体复制
+    """
+
+    def __init__(self, out, ticks_per_beat=480):
+        self.out = out
+        self.length = 0  # 轨道数据长度
+        self.status = 0  # 当前运行状态，0 表示没有
+        # 文件头：格式 1，1 个轨道
+        out.write(b"MThd" + struct.pack(">IHHH", 6, 1, 1, ticks_per_beat))
+        if self.__seekable(out):
+            out.write(b"MTrk\0\0\0\0")
+            self.length_pos = out.tell() - 4
+            self.track = out
+        else:
+            self.length_pos = None
+            self.track = tempfile.TemporaryFile()
+
+    def meta(self, meta_type: int, data: bytes, delta=0):
+        """
+        写入元事件，元事件会取消运行状态
+        """
+        self.write(var_len(delta) + bytes((0xFF, meta_type)) + var_len(len(data)) + data)
+        self.status = 0
+
+    def message(self, status: int, *data: int, delta=0):
+        """
+        写入通道消息，状态与上一条相同时省略状态字节
+        """
+        head = var_len(delta)
+        if status != self.status:
+            head += bytes((status,))
+            self.status = status
+        self.write(head + bytes(data))
+
+    def write(self, data: bytes):
+        """
+        写入已编码的事件字节
+        """
+        self.track.write(data)
+        self.length += len(data)
+
+    def notes(self, data: bytes):
+        """
+        写入 join_chord 拼接的音符事件，写入后运行状态为 note_on
+        """
+        if data:
+            self.write(data)
+            self.status = NOTE_ON
+
+    def close(self):
+        """
+        写入轨道结束事件并回填轨道长度
+        """
+        self.meta(0x2F, b"", delta=1)
+        length = struct.pack(">I", self.length)
+        if self.length_pos is not None:
+            end = self.out.tell()
+            self.out.seek(self.length_pos)
+            self.out.write(length)
+            self.out.seek(end)
+        else:
+            self.out.write(b"MTrk" + length)
+            self.track.seek(0)
+            shutil.copyfileobj(self.track, self.out)
+            self.track.close()
+        self.out.flush()
+
+    @staticmethod
+    def __seekable(out):
+        try:
+            return out.seekable()
+        except (AttributeError, ValueError):
+            return False
+
+
+GAP_DELTA = var_len(NOTE_GAP)
+LENGTH_DELTA = var_len(NOTE_LENGTH)
+
+
+def lane_events(chords) -> tuple[tuple[bytes, bytes], ...]:
+    """
+    预先编码每个字节对应的音符按下、抬起事件，delta 均为 0，使用 note_on 运行状态
+    :param chords: 字节 -> 音符元组
+    """
+    return tuple(
+        (
+            b"".join(b"\0" + bytes((note, VELOCITY)) for note in notes),
+            b"".join(b"\0" + bytes((note, 0)) for note in notes),
+        )
+        for notes in chords
+    )
+
+
+def join_chord(on: bytes, off: bytes, leading=False) -> bytes:
+    """
+    拼接一个和弦的事件：首个按下事件间隔 NOTE_GAP，首个抬起事件间隔 NOTE_LENGTH
+    第一个和弦没有间隔，且需要写入 note_on 状态字节
+    """
+    if not on:
+        return b""  # 没有音符的和弦不产生事件
+    head = b"\0" + bytes((NOTE_ON,)) if leading else GAP_DELTA
+    return head + on[1:] + LENGTH_DELTA + off[1:]
+
+
+def chord_events(chords) -> tuple[bytes, ...]:
+    """
+    预先编码每个字节对应的完整和弦事件
+    :param chords: 字节 -> 音符元组
+    """
+    return tuple(join_chord(on, off) for on, off in lane_events(chords))
@@ -0,0 +1,36 @@
+# 执行字节码文件：只导入虚拟机与字节码加载，不导入编译器前端与 mido
+import argparse
+import os
+import sys
+
+from .core import bytecode, machine
+from .core.compile_error import TestRuntimeError
+from .core.ir import Program
+
+__author__ = 'mori'
+
+
+def run(program: Program):
+    """
+    执行链接后的程序
+    """
+    try:
+        machine_exe = machine.Machine(program)  # 初始化虚拟机
+        machine_exe.execute()  # 执行
+    except TestRuntimeError as e:
+        e.print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m src.run', description='执行编译好的字节码文件')
+    parser.add_argument('mbc_path', help='字节码文件（.mbc）路径，由 python -m src.main -o 生成')
+    args = parser.parse_args()
+    if not os.path.isfile(args.mbc_path):
+        print(f"错误：文件 '{args.mbc_path}' 不存在")
+        sys.exit(1)
+    try:
+        mbc_program = bytecode.load(args.mbc_path)
+    except bytecode.BytecodeError as e:
+        print(f"错误：{e}")
+        sys.exit(1)
+    run(mbc_program)